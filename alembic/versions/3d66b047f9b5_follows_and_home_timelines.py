@@ -0,0 +1,54 @@
+"""follows and home timelines
+
+Revision ID: 3d66b047f9b5
+Revises: 7b92582b654a
+Create Date: 2026-10-17 06:09:05.999586
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d66b047f9b5'
+down_revision: Union[str, Sequence[str], None] = '7b92582b654a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('follows',
+    sa.Column('follower_id', sa.Integer(), nullable=False),
+    sa.Column('followee_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('NOW()'), nullable=False),
+    sa.ForeignKeyConstraint(['followee_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['follower_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('follower_id', 'followee_id')
+    )
+    op.create_index(op.f('ix_follows_followee_id'), 'follows', ['followee_id'], unique=False)
+    op.add_column('users', sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+
+    # timelines start out empty, they fill up as people post and follow
+    op.create_table('timelines',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    op.create_index('ix_timelines_user_id_created_at_post_id', 'timelines', ['user_id', 'created_at', 'post_id'], unique=False)
+    op.create_index('ix_posts_owner_id_created_at_id', 'posts', ['owner_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_posts_owner_id_created_at_id', table_name='posts')
+    op.drop_index('ix_timelines_user_id_created_at_post_id', table_name='timelines')
+    op.drop_table('timelines')
+    op.drop_column('users', 'follower_count')
+    op.drop_index(op.f('ix_follows_followee_id'), table_name='follows')
+    op.drop_table('follows')
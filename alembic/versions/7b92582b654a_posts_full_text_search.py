@@ -0,0 +1,37 @@
+"""posts full text search
+
+Revision ID: 7b92582b654a
+Revises: f43b8336bd4d
+Create Date: 2026-10-17 06:01:18.160075
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b92582b654a'
+down_revision: Union[str, Sequence[str], None] = 'f43b8336bd4d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # a btree on the whole post body can't answer searches and breaks on long posts
+    op.drop_index(op.f('ix_posts_content'), table_name='posts')
+    op.add_column('posts', sa.Column(
+        'search_vector', postgresql.TSVECTOR(),
+        sa.Computed("to_tsvector('english', title || ' ' || content)", persisted=True),
+        nullable=True))
+    op.create_index('ix_posts_search_vector', 'posts', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_posts_search_vector', table_name='posts', postgresql_using='gin')
+    op.drop_column('posts', 'search_vector')
+    op.create_index(op.f('ix_posts_content'), 'posts', ['content'], unique=False)
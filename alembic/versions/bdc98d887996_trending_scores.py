@@ -0,0 +1,44 @@
+"""trending scores
+
+Revision ID: bdc98d887996
+Revises: 3d66b047f9b5
+Create Date: 2026-10-17 06:10:36.371633
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bdc98d887996'
+down_revision: Union[str, Sequence[str], None] = '3d66b047f9b5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # existing votes get the migration time, we never recorded when they were cast
+    op.add_column('votes', sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('NOW()'), nullable=False))
+    op.add_column('posts', sa.Column('votes_changed_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('NOW()'), nullable=False))
+    op.create_index(op.f('ix_posts_votes_changed_at'), 'posts', ['votes_changed_at'], unique=False)
+    # filled by the app's first trending refresh, the table starts empty
+    op.create_table('post_scores',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('post_id')
+    )
+    op.create_index('ix_post_scores_score_post_id', 'post_scores', ['score', 'post_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_post_scores_score_post_id', table_name='post_scores')
+    op.drop_table('post_scores')
+    op.drop_index(op.f('ix_posts_votes_changed_at'), table_name='posts')
+    op.drop_column('posts', 'votes_changed_at')
+    op.drop_column('votes', 'created_at')
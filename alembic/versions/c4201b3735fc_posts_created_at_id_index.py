@@ -0,0 +1,28 @@
+"""posts created_at id index
+
+Revision ID: c4201b3735fc
+Revises: 592f0328655d
+Create Date: 2026-10-17 05:53:50.695216
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4201b3735fc'
+down_revision: Union[str, Sequence[str], None] = '592f0328655d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # backs the keyset pagination on GET /posts/ (ORDER BY created_at DESC, id DESC)
+    op.create_index('ix_posts_created_at_id', 'posts', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_posts_created_at_id', table_name='posts')
@@ -0,0 +1,36 @@
+"""refresh token partial indexes
+
+Revision ID: f10121ecbc3e
+Revises: bdc98d887996
+Create Date: 2026-10-17 06:11:58.197945
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f10121ecbc3e'
+down_revision: Union[str, Sequence[str], None] = 'bdc98d887996'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # revoked tokens were kept forever, clear them out before indexing
+    op.execute("DELETE FROM refresh_tokens WHERE is_active IS NOT TRUE OR expires_at <= NOW() AT TIME ZONE 'UTC'")
+    op.drop_index(op.f('ix_refresh_tokens_token'), table_name='refresh_tokens')
+    op.create_index('ix_refresh_tokens_active_token', 'refresh_tokens', ['token'], unique=True,
+                    postgresql_where=sa.text('is_active'))
+    op.create_index('ix_refresh_tokens_active_expires_at', 'refresh_tokens', ['expires_at'], unique=False,
+                    postgresql_where=sa.text('is_active'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_refresh_tokens_active_expires_at', table_name='refresh_tokens')
+    op.drop_index('ix_refresh_tokens_active_token', table_name='refresh_tokens')
+    op.create_index(op.f('ix_refresh_tokens_token'), 'refresh_tokens', ['token'], unique=True)
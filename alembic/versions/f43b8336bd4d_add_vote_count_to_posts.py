@@ -0,0 +1,34 @@
+"""add vote_count to posts
+
+Revision ID: f43b8336bd4d
+Revises: c4201b3735fc
+Create Date: 2026-10-17 05:54:21.669340
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f43b8336bd4d'
+down_revision: Union[str, Sequence[str], None] = 'c4201b3735fc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('posts', sa.Column('vote_count', sa.Integer(), server_default='0', nullable=False))
+    # backfill from the votes table, after this create_vote keeps it in sync
+    op.execute(
+        "UPDATE posts SET vote_count = v.cnt "
+        "FROM (SELECT post_id, COUNT(*) AS cnt FROM votes GROUP BY post_id) AS v "
+        "WHERE posts.id = v.post_id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('posts', 'vote_count')
@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from fastapi import Request, Response, status
+
+from . import compression
+from .config import settings
+
+
+class CacheBackend:
+    """Storage behind a Cache. Values must be JSON friendly so they can live
+    outside the process (see RedisBackend)."""
+
+    async def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: float, tags: Iterable[str] = ()):
+        raise NotImplementedError
+
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    async def delete_tags(self, *tags: str):
+        """Delete every key that was set with one of these tags"""
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """Per-process LRU with a TTL on every entry"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: OrderedDict[str, tuple[float, Any, tuple[str, ...]]] = OrderedDict()
+        self._tags: dict[str, set[str]] = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    async def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value, _ = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key, value, ttl, tags=()):
+        self._remove(key)
+        tags = tuple(tags)
+        self._data[key] = (time.monotonic() + ttl, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._data) > self.max_size:
+            self._remove(next(iter(self._data)))
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._remove(key)
+
+    async def delete_tags(self, *tags):
+        for tag in tags:
+            for key in self._tags.pop(tag, ()):
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisBackend(CacheBackend):
+    """Shared backend so every worker sees the same entries and invalidations"""
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("cache_redis_url is set but the redis package is not installed")
+        self._redis = redis.from_url(url)
+
+    async def get(self, key):
+        raw = await self._redis.get(key)
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, key, value, ttl, tags=()):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.set(key, json.dumps(value), px=int(ttl * 1000))
+            for tag in tags:
+                pipe.sadd(f"tag:{tag}", key)
+                pipe.pexpire(f"tag:{tag}", int(ttl * 1000))
+            await pipe.execute()
+
+    async def delete(self, *keys):
+        if keys:
+            await self._redis.delete(*keys)
+
+    async def delete_tags(self, *tags):
+        for tag in tags:
+            keys = await self._redis.smembers(f"tag:{tag}")
+            await self._redis.delete(f"tag:{tag}", *keys)
+
+
+def make_backend(max_size: int) -> CacheBackend:
+    if settings.cache_redis_url:
+        return RedisBackend(settings.cache_redis_url)
+    return MemoryBackend(max_size)
+
+
+class Cache:
+    """Namespaced cache with hit/miss counters on top of a CacheBackend"""
+
+    def __init__(self, namespace: str, backend: CacheBackend, ttl: float, reinvalidate_after: float = 0):
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+        # when loads read from replicas: how late a replica may still return
+        # what an invalidation just removed, see _invalidate_again
+        self.reinvalidate_after = reinvalidate_after
+        self._pending_invalidations: set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        # single-flight: key -> future of the load already running for it
+        self._loading: dict[str, asyncio.Future] = {}
+        self._generation = 0
+
+    def _key(self, key) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key):
+        value = await self.backend.get(self._key(key))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key, value, tags: Iterable[str] = ()):
+        await self.backend.set(self._key(key), value, self.ttl,
+                               tags=[self._key(tag) for tag in tags])
+
+    async def invalidate(self, *keys):
+        self._forget_loads()
+        keys = [self._key(key) for key in keys]
+        await self.backend.delete(*keys)
+        self._invalidate_again(self.backend.delete, keys)
+
+    async def invalidate_tags(self, *tags):
+        self._forget_loads()
+        tags = [self._key(tag) for tag in tags]
+        await self.backend.delete_tags(*tags)
+        self._invalidate_again(self.backend.delete_tags, tags)
+
+    def _invalidate_again(self, delete, names):
+        # a replica that hasn't replayed the write yet can hand the old row to
+        # the next miss, which caches it again. Delete once more after any
+        # replica still in rotation must have caught up.
+        if not self.reinvalidate_after:
+            return
+
+        async def later():
+            await asyncio.sleep(self.reinvalidate_after)
+            self._forget_loads()
+            await delete(*names)
+
+        task = asyncio.create_task(later())
+        self._pending_invalidations.add(task)
+        task.add_done_callback(self._pending_invalidations.discard)
+
+    def _forget_loads(self):
+        # loads that started before an invalidation may return stale data:
+        # don't let new callers join them and don't store what they return
+        self._generation += 1
+        self._loading.clear()
+
+    async def get_or_load(self, key, loader: Callable[[], Awaitable[tuple[Any, Iterable[str]]]]):
+        """Return the cached value, or run loader() to build it.
+
+        loader returns (value, tags). Concurrent misses for the same key share
+        a single loader call instead of all hitting the database."""
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        loading = self._loading.get(key)
+        if loading is not None:
+            try:
+                return await asyncio.shield(loading)
+            except asyncio.CancelledError:
+                if not loading.cancelled():
+                    raise
+                # the request doing the load went away, do it ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        generation = self._generation
+        try:
+            value, tags = await loader()
+            if generation == self._generation:
+                await self.set(key, value, tags)
+            future.set_result(value)
+            return value
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # mark retrieved, nobody may be waiting on it
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+
+    def stats(self) -> dict:
+        stats = {"hits": self.hits, "misses": self.misses}
+        if isinstance(self.backend, MemoryBackend):
+            stats["size"] = len(self.backend)
+        return stats
+
+
+# rendered GET /posts responses, invalidated by tag when posts or votes change
+post_cache = Cache("posts", make_backend(settings.post_cache_max_size), ttl=settings.post_cache_ttl_seconds,
+                   reinvalidate_after=(settings.replica_max_lag_seconds + settings.replica_health_interval
+                                       if settings.database_replica_urls else 0))
+
+
+def make_etag_entry(body: str) -> dict:
+    """Cache entry for a rendered JSON body, with its strong ETag"""
+    digest = hashlib.blake2b(body.encode(), digest_size=16).hexdigest()
+    return {"etag": f'"{digest}"', "body": body}
+
+
+def etag_response(request: Request, entry: dict) -> Response:
+    """200 with the cached body, or an empty 304 if the client already has it.
+
+    The body goes out compressed when the client accepts it, from a copy kept
+    in compression.compressed_bodies (CompressionMiddleware leaves it alone)."""
+    body = entry["body"].encode()
+    codec = None
+    if len(body) >= settings.compression_min_size:
+        codec = compression.negotiate(request.headers.get("accept-encoding"))
+    etag = compression.encoded_etag(entry["etag"], codec) if codec else entry["etag"]
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if settings.compression_enabled:
+        headers["Vary"] = "Accept-Encoding"
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [compression.decoded_etag(tag.strip()) for tag in if_none_match.split(",")]
+        if entry["etag"] in tags or "*" in tags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if codec:
+        body = compression.compressed_bodies.get(entry["etag"], body, codec)
+        headers["Content-Encoding"] = codec
+    return Response(content=body, media_type="application/json", headers=headers)
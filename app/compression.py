@@ -0,0 +1,284 @@
+import logging
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from .config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+class Codec:
+    """One Content-Encoding. compress() does a whole body, stream() returns a
+    compressor for bodies sent in chunks (StreamingResponse)"""
+
+    name: str
+
+    def __init__(self, level: int):
+        self.level = level
+
+    def compress(self, body: bytes) -> bytes:
+        raise NotImplementedError
+
+    def stream(self) -> "Stream":
+        raise NotImplementedError
+
+
+class Stream:
+    """Every chunk comes out flushed so the client can decode it as soon as it
+    arrives, finish() ends the stream"""
+
+    def compress(self, chunk: bytes) -> bytes:
+        raise NotImplementedError
+
+    def finish(self) -> bytes:
+        raise NotImplementedError
+
+
+class GzipCodec(Codec):
+    name = "gzip"
+
+    def compress(self, body):
+        return zlib.compress(body, self.level, wbits=31)  # 31 = gzip container
+
+    def stream(self):
+        return GzipStream(self.level)
+
+
+class GzipStream(Stream):
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, wbits=31)
+
+    def compress(self, chunk):
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliCodec(Codec):
+    name = "br"
+
+    def compress(self, body):
+        return brotli.compress(body, quality=self.level)
+
+    def stream(self):
+        return BrotliStream(self.level)
+
+
+class BrotliStream(Stream):
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, chunk):
+        return self._compressor.process(chunk) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdCodec(Codec):
+    name = "zstd"
+
+    def __init__(self, level: int):
+        super().__init__(level)
+        self._compressor = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, body):
+        return self._compressor.compress(body)
+
+    def stream(self):
+        return ZstdStream(self.level)
+
+
+class ZstdStream(Stream):
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, chunk):
+        return self._compressor.compress(chunk) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def make_codecs() -> dict[str, Codec]:
+    """Installed codecs from settings.compression_codecs, in that order"""
+    installed = {"gzip": lambda: GzipCodec(settings.compression_gzip_level)}
+    if brotli is not None:
+        installed["br"] = lambda: BrotliCodec(settings.compression_brotli_quality)
+    if zstandard is not None:
+        installed["zstd"] = lambda: ZstdCodec(settings.compression_zstd_level)
+    codecs = {}
+    for name in settings.compression_codecs:
+        if name in installed:
+            codecs[name] = installed[name]()
+        else:
+            logger.info("Not offering %s compression, its package isn't installed", name)
+    return codecs
+
+
+codecs = make_codecs()
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Codec to answer with, None for no compression. The highest q value
+    wins, ties go to the first in settings.compression_codecs. Cached, there
+    are only so many different Accept-Encoding headers out there."""
+    if not settings.compression_enabled or not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for name in codecs:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def encoded_etag(etag: str, codec: str) -> str:
+    """Strong ETags are per representation, "abc" sent gzipped is "abc-gzip\""""
+    if etag.startswith("W/"):
+        return etag
+    return f'{etag[:-1]}-{codec}"'
+
+
+def decoded_etag(etag: str) -> str:
+    """encoded_etag() undone, for matching If-None-Match"""
+    for codec in codecs:
+        suffix = f'-{codec}"'
+        if etag.endswith(suffix):
+            return f'{etag[:-len(suffix)]}"'
+    return etag
+
+
+class CompressedBodies:
+    """Compressed copies of cached response bodies, so a hot page isn't
+    compressed again on every hit. Keyed by (ETag, codec), the ETag is a hash
+    of the body so nothing here can go stale, old bodies fall out of the LRU."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._bodies: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+
+    def get(self, etag: str, body: bytes, codec: str) -> bytes:
+        key = (etag, codec)
+        compressed = self._bodies.get(key)
+        if compressed is not None:
+            self._bodies.move_to_end(key)
+            return compressed
+        compressed = codecs[codec].compress(body)
+        self._bodies[key] = compressed
+        while len(self._bodies) > self.max_size:
+            self._bodies.popitem(last=False)
+        return compressed
+
+
+compressed_bodies = CompressedBodies(settings.compression_cache_max_size)
+
+
+def compressible(status: int, headers: Headers) -> bool:
+    content_type = headers.get("content-type", "")
+    return (status not in (204, 304)
+            and "content-encoding" not in headers
+            and content_type.startswith(COMPRESSIBLE_TYPES)
+            # a few bytes per event, nothing to gain
+            and not content_type.startswith("text/event-stream"))
+
+
+class CompressionMiddleware:
+    """Compresses JSON / NDJSON / text responses with the codec negotiated
+    from Accept-Encoding.
+
+    Whole bodies under compression_min_size go out as they are. Streamed
+    bodies are compressed chunk by chunk as they're sent. Responses that
+    already have a Content-Encoding (the cached pages from etag_response,
+    /posts/export?gzip=true) are left alone."""
+
+    def __init__(self, app, minimum_size: int = settings.compression_min_size):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        stream = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, stream, passthrough
+            if passthrough or message["type"] not in ("http.response.start", "http.response.body"):
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                # held back until the first body chunk says how big the body is
+                start = message
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is not None:
+                data = stream.compress(body) if body else b""
+                if not more_body:
+                    data += stream.finish()
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+                return
+
+            headers = MutableHeaders(raw=start.setdefault("headers", []))
+            can_compress = compressible(start["status"], headers)
+            if not can_compress or (not more_body and len(body) < self.minimum_size):
+                if can_compress:
+                    headers.add_vary_header("Accept-Encoding")
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            headers["Content-Encoding"] = name
+            headers.add_vary_header("Accept-Encoding")
+            if "etag" in headers:
+                headers["ETag"] = encoded_etag(headers["etag"], name)
+            if more_body:
+                del headers["Content-Length"]
+                stream = codecs[name].stream()
+                data = stream.compress(body)
+            else:
+                data = codecs[name].compress(body)
+                headers["Content-Length"] = str(len(data))
+            await send(start)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
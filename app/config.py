@@ -1,8 +1,27 @@
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     database_driver_name: str = "postgresql"
+    # driver used by the request path, any SQLAlchemy async dialect works here
+    # ("postgresql+asyncpg", "postgresql+psycopg", ...)
+    database_async_driver_name: str = "postgresql+asyncpg"
+    # read replicas as a JSON list of URLs, e.g.
+    # DATABASE_REPLICA_URLS='["postgresql://app:pw@replica1:5432/fastapi"]'
+    database_replica_urls: list[str] = []
+    replica_health_interval: float = 5.0
+    replica_health_timeout: float = 2.0
+    # replicas further behind than this are taken out of rotation
+    replica_max_lag_seconds: float = 5.0
+    # reads stay on the primary this long after a client writes
+    read_your_writes_seconds: int = 10
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    # seconds before a connection is replaced, -1 keeps them forever
+    db_pool_recycle: int = -1
+    db_pool_pre_ping: bool = False
     database_hostname: str
     database_port: str
     database_password: str
@@ -11,6 +30,88 @@ class Settings(BaseSettings):
     secret_key: str
     algorithm: str
     access_token_expire_minutes: int
+    posts_page_default_limit: int = 20
+    posts_page_max_limit: int = 100
+    # characters of content in the excerpt field (?fields=excerpt)
+    post_excerpt_length: int = 200
+    # rows fetched per round trip from the server-side cursor in /posts/export
+    export_batch_size: int = 1000
+    # set this to share caches between workers, otherwise each process keeps its own
+    cache_redis_url: Optional[str] = None
+    user_cache_ttl_seconds: int = 60
+    user_cache_max_size: int = 10000
+    post_cache_ttl_seconds: int = 300
+    post_cache_max_size: int = 5000
+    # response compression, negotiated from Accept-Encoding. br needs the brotli
+    # package and zstd the zstandard package, the ones not installed aren't offered.
+    # The order breaks ties between codecs the client likes equally.
+    compression_enabled: bool = True
+    compression_codecs: list[str] = ["zstd", "br", "gzip"]
+    compression_min_size: int = 1024
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 4
+    compression_zstd_level: int = 3
+    # compressed copies of post_cache bodies kept per process
+    compression_cache_max_size: int = 5000
+    vote_batch_max_size: int = 100
+    # seconds between post_scores refreshes, 0 turns the job off
+    trending_refresh_interval: float = 30.0
+    # a post needs 10x the votes to keep its hot score after this many seconds
+    trending_decay_seconds: int = 45000
+    # entries kept per user in the precomputed home timeline
+    timeline_max_length: int = 800
+    # seconds between trims of the timelines new posts grew past timeline_max_length,
+    # and users trimmed per transaction. 0 turns trimming off.
+    timeline_trim_interval: float = 30.0
+    timeline_trim_batch_size: int = 100
+    # authors with at least this many followers aren't fanned out on write,
+    # their posts are pulled into followers' feeds at read time instead
+    fanout_max_followers: int = 10000
+    # accept POST /votes/ into an in-process buffer and write them in bulk. A vote
+    # shows up on reads served by other workers only after the next flush
+    vote_write_behind: bool = False
+    vote_buffer_max_pending: int = 10000
+    vote_buffer_flush_size: int = 500
+    vote_buffer_flush_interval: float = 1.0
+    # live vote counts (GET /posts/{id}/live, WS /posts/{id}/live/ws): a changed
+    # post is pushed at most once per live_interval seconds
+    live_interval: float = 1.0
+    live_heartbeat_seconds: float = 15.0
+    # updates a subscriber may fall behind on before it gets disconnected
+    live_queue_size: int = 16
+    live_max_subscribers: int = 10000
+    # pass vote changes to the other workers through postgres LISTEN/NOTIFY
+    live_notify: bool = False
+    # prometheus middleware + /metrics, nothing is recorded while this is off
+    metrics_enabled: bool = False
+    # /internal/pool, /internal/cache, /internal/live debug routes. They have no
+    # auth, only turn them on where the app isn't reachable from outside
+    internal_routes_enabled: bool = False
+    # SQL statement budgets per route: "off", "log" or "raise" (for tests / CI)
+    sql_budget_mode: Literal["off", "log", "raise"] = "off"
+    # seconds between deletes of revoked / expired refresh tokens, 0 = off
+    refresh_token_compact_interval: float = 3600.0
+    refresh_token_compact_batch_size: int = 1000
+    # token bucket limits as "<count>/<second|minute|hour|day>"
+    rate_limit_enabled: bool = True
+    rate_limit_redis_url: Optional[str] = None
+    rate_limit_max_keys: int = 100000
+    # only behind a proxy that sets X-Forwarded-For, otherwise clients can pick their IP
+    rate_limit_trust_forwarded_for: bool = False
+    rate_limit_login_ip: str = "20/minute"
+    rate_limit_login_username: str = "5/minute"
+    rate_limit_signup_ip: str = "10/minute"
+    rate_limit_refresh_ip: str = "60/minute"
+    rate_limit_write_user: str = "120/minute"
+    # requests allowed to wait for a DB connection before get_async_db answers 503
+    db_admission_max_queue: int = 32
+    # fill the DB pool and start the hashing workers before serving traffic
+    warmup_on_startup: bool = False
+    bcrypt_rounds: int = 12
+    hash_pool_workers: int = 2
+    # hashing jobs allowed to wait for a free worker before we answer 503
+    hash_pool_max_queue: int = 32
+    hash_timeout_seconds: float = 5.0
 
     class Config:
         env_file = ".env"
@@ -1,6 +1,10 @@
-from sqlalchemy import create_engine
+import time
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, status
+from sqlalchemy import event
 from sqlalchemy.engine import URL
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from .config import settings
 
@@ -15,16 +19,113 @@ url = URL.create(
 
 )
 
-engine = create_engine(url)
-Session_local = sessionmaker(autoflush=False, autocommit=False, bind=engine)
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that keeps live counters, see pool_status()"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = {"checkouts": 0, "checkins": 0, "connects": 0, "invalidations": 0,
+                      "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+    def connect(self):
+        # time spent waiting for a free connection (or opening a new one), the
+        # pool events below only fire once a connection has been handed out
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            waited = time.perf_counter() - start
+            self.stats["wait_seconds_total"] += waited
+            self.stats["wait_seconds_max"] = max(self.stats["wait_seconds_max"], waited)
+
+
+def listen_pool_events(pool: InstrumentedPool):
+    """Count checkouts / checkins / new and invalidated connections on a pool"""
+    stats = pool.stats
+
+    def bump(name):
+        def listener(*args):
+            stats[name] += 1
+        return listener
+
+    event.listen(pool, "checkout", bump("checkouts"))
+    event.listen(pool, "checkin", bump("checkins"))
+    event.listen(pool, "connect", bump("connects"))
+    event.listen(pool, "invalidate", bump("invalidations"))
+
+
+def pool_status(engine) -> dict:
+    """Snapshot of a pool: connections in use / idle / overflow plus the counters"""
+    pool = engine.pool
+    stats = pool.stats
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": pool._max_overflow,
+        **stats,
+        "wait_seconds_avg": stats["wait_seconds_total"] / stats["checkouts"] if stats["checkouts"] else 0.0,
+        "admitted_sessions": _db_sessions.get(engine, 0),
+    }
+
+
+def make_async_engine(engine_url):
+    """Async engine with the pool settings from config and pool counters attached"""
+    async_engine = create_async_engine(
+        engine_url,
+        poolclass=InstrumentedPool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+    )
+    listen_pool_events(async_engine.pool)
+    return async_engine
+
+
+# async engine used by every route, so queries never block the event loop.
+# size the pool so workers * (pool_size + max_overflow) stays under postgres max_connections
+async_engine = make_async_engine(url.set(drivername=settings.database_async_driver_name))
+# expire_on_commit=False: touching an attribute after commit would otherwise
+# need a lazy load, and lazy IO isn't allowed on an AsyncSession
+AsyncSession_local = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-def get_db():
-    db = Session_local()
+
+# requests currently holding a session, per engine
+_db_sessions: dict = {}
+
+
+def check_admission(bind):
+    """503 if bind's pool is saturated, see admitted_session"""
+    if _db_sessions.get(bind, 0) >= settings.db_pool_size + settings.db_max_overflow + settings.db_admission_max_queue:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Server is busy, try again shortly",
+                            headers={"Retry-After": "1"})
+
+
+@asynccontextmanager
+async def admitted_session(bind):
+    """AsyncSession on bind, or a 503 right away when its pool is saturated.
+
+    Admission control: once more requests want a connection than the pool
+    can hand out plus a short queue, new ones are turned away now instead of
+    waiting out pool_timeout."""
+    check_admission(bind)
+    _db_sessions[bind] = _db_sessions.get(bind, 0) + 1
     try:
-        yield db
+        async with AsyncSession_local(bind=bind) as db:
+            yield db
     finally:
-        db.close()
+        _db_sessions[bind] -= 1
+
+
+async def get_async_db():
+    async with admitted_session(async_engine) as db:
+        yield db
         
          
 # while True:
@@ -1,21 +1,76 @@
-from operator import contains
-import re
-from fastapi import Depends, FastAPI, Response, status, HTTPException
-from fastapi.params import Body
-from random import randrange
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import time
-from sqlalchemy.orm import Session
-from . import models, schemas, utils
-from .database import engine, get_db
-from .routers import post, user, auth, vote
-
-models.Base.metadata.create_all(bind=engine)
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from . import compression, metrics, oauth2, query_budget, timeline, trending, utils, vote_hub, warmup
+from .config import settings
+from .database import async_engine
+from .routers import post, user, auth, vote, internal, follow, feed, live
+from .replicas import ReadYourWritesMiddleware, replicas
+from .tasks import PeriodicTask
+
+score_refresher = PeriodicTask("trending-refresh", trending.refresh_scores, settings.trending_refresh_interval)
+replica_checker = PeriodicTask("replica-health", replicas.check, settings.replica_health_interval)
+token_compactor = PeriodicTask("refresh-token-compaction", oauth2.compact_refresh_tokens,
+                               settings.refresh_token_compact_interval)
+timeline_trimmer = PeriodicTask("timeline-trim", timeline.trim_pending, settings.timeline_trim_interval)
+live_pusher = PeriodicTask("live-votes", vote_hub.hub.tick, settings.live_interval)
+
+# the schema is managed by alembic (`alembic upgrade head` before starting),
+# nothing here touches the database at import time
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.warmup_on_startup:
+        await warmup.warm_up()
+    if replicas:
+        # know which replicas are up before the first read comes in
+        await replicas.check()
+        replica_checker.start()
+    if settings.vote_write_behind:
+        vote.vote_buffer.start()
+    if settings.trending_refresh_interval > 0:
+        score_refresher.start()
+    if settings.refresh_token_compact_interval > 0:
+        token_compactor.start()
+    if settings.timeline_trim_interval > 0:
+        timeline_trimmer.start()
+    await vote_hub.hub.start()
+    live_pusher.start()
+    yield
+    await live_pusher.stop()
+    await vote_hub.hub.stop()
+    await timeline_trimmer.stop()
+    await token_compactor.stop()
+    await score_refresher.stop()
+    if settings.vote_write_behind:
+        await vote.vote_buffer.stop()
+    utils.shutdown_hash_pool()
+    await replica_checker.stop()
+    await replicas.dispose()
+    # the pooled connections belong to this event loop, close them with it
+    await async_engine.dispose()
 
 
 app = FastAPI(title="My First FastAPI App",
-              description="This is my first FastAPI app, I am learning fastapi and I am enjoying it", version="0.0.1")
+              description="This is my first FastAPI app, I am learning fastapi and I am enjoying it", version="0.0.1",
+              lifespan=lifespan,
+              default_response_class=metrics.TimedJSONResponse)
+
+if settings.metrics_enabled or settings.sql_budget_mode != "off":
+    metrics.instrument_engine(async_engine.sync_engine)
+    for replica in replicas.replicas:
+        metrics.instrument_engine(replica.engine.sync_engine)
+if settings.compression_enabled:
+    # innermost, so the request metrics include the time spent compressing
+    app.add_middleware(compression.CompressionMiddleware)
+if settings.sql_budget_mode != "off":
+    # added before MetricsMiddleware so it sits inside it and reuses its counter
+    app.add_middleware(query_budget.QueryBudgetMiddleware, mode=settings.sql_budget_mode)
+if replicas:
+    app.add_middleware(ReadYourWritesMiddleware)
+if settings.metrics_enabled:
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.add_route("/metrics", metrics.metrics_endpoint, include_in_schema=False)
 
 
 @app.get("/")
@@ -26,6 +81,11 @@ app.include_router(user.router)
 app.include_router(post.router)
 app.include_router(auth.router)
 app.include_router(vote.router)
+app.include_router(follow.router)
+app.include_router(feed.router)
+app.include_router(live.router)
+if settings.internal_routes_enabled:
+    app.include_router(internal.router)
 
 
 
@@ -0,0 +1,173 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from starlette.requests import Request
+from starlette.responses import Response
+
+REQUESTS = Counter("http_requests_total", "Requests handled",
+                   ["method", "route", "status"])
+ERRORS = Counter("http_request_errors_total", "Requests that ended in a 5xx",
+                 ["method", "route"])
+LATENCY = Histogram("http_request_duration_seconds", "Time until the response was fully sent",
+                    ["method", "route"])
+_FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+DB_TIME = Histogram("http_request_db_seconds", "Time spent in database calls per request",
+                    ["method", "route"], buckets=_FAST_BUCKETS)
+SERIALIZE_TIME = Histogram("http_request_serialize_seconds", "Time spent rendering response bodies per request",
+                           ["method", "route"], buckets=_FAST_BUCKETS)
+
+
+class RequestTimings:
+    __slots__ = ("db_seconds", "serialize_seconds", "statements")
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.statements = 0
+
+
+# timings of the request running in the current task, None outside requests
+# (or when metrics are off)
+current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def track_serialization():
+    """Count the wrapped block as serialization time for the current request"""
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serialize_seconds += time.perf_counter() - start
+
+
+@contextmanager
+def untracked():
+    """Don't charge the wrapped block to the current request (background work
+    running after the response, like timeline fan-out)"""
+    token = current_timings.set(None)
+    try:
+        yield
+    finally:
+        current_timings.reset(token)
+
+
+# same "Z" suffix pydantic writes for UTC datetimes
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+class TimedJSONResponse(ORJSONResponse):
+    """orjson response that reports its render() time as serialization"""
+
+    def render(self, content) -> bytes:
+        with track_serialization():
+            return dumps(content)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.statements += 1
+        context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = current_timings.get()
+    start = getattr(context, "_metrics_start", None)
+    if timings is not None and start is not None:
+        timings.db_seconds += time.perf_counter() - start
+
+
+def instrument_engine(engine):
+    """Attribute statement count and time on this engine to the current request"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording count, errors, latency, DB and
+    serialization time per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_timings.reset(token)
+            # the router stores the matched route in the scope, label by its
+            # template so /posts/1 and /posts/2 share a series
+            route = scope.get("route")
+            template = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            REQUESTS.labels(method, template, str(status_code)).inc()
+            if status_code >= 500:
+                ERRORS.labels(method, template).inc()
+            LATENCY.labels(method, template).observe(elapsed)
+            DB_TIME.labels(method, template).observe(timings.db_seconds)
+            SERIALIZE_TIME.labels(method, template).observe(timings.serialize_seconds)
+
+
+class PoolCollector:
+    """Exports pool_status() and the cache counters at scrape time"""
+
+    def collect(self):
+        from . import cache, oauth2
+        from .database import async_engine, pool_status
+
+        pool = GaugeMetricFamily("db_pool", "Connection pool state", labels=["stat"])
+        for stat, value in pool_status(async_engine).items():
+            pool.add_metric([stat], value)
+        yield pool
+
+        caches = GaugeMetricFamily("cache_requests", "Cache lookups", labels=["cache", "result"])
+        for name, c in (("user", oauth2.user_cache), ("posts", cache.post_cache)):
+            caches.add_metric([name, "hit"], c.hits)
+            caches.add_metric([name, "miss"], c.misses)
+        yield caches
+
+
+REGISTRY.register(PoolCollector())
+
+
+async def metrics_endpoint(request: Request):
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # several workers: merge what every process wrote to the shared dir
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
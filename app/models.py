@@ -1,6 +1,7 @@
 from datetime import datetime
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Boolean, text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Computed, DateTime, Float, ForeignKey, Index, Integer, String, Boolean, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, joinedload, query_expression, relationship, synonym
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from .database import Base
 
@@ -10,14 +11,35 @@ class Posts(Base):
 
     id = Column(Integer, primary_key=True, index=True, nullable=False)
     title = Column(String, index=True, nullable=False)
-    content = Column(String, index=True, nullable=False)
+    content = Column(String, nullable=False)
     published = Column(Boolean, server_default='TRUE', nullable=False)
     contact = Column(String, index=True, nullable=True)
     created_at = Column(TIMESTAMP(timezone=True),
                         server_default=text('NOW()'), nullable=False)
     owner_id = Column(Integer, ForeignKey(
         "users.id", ondelete="CASCADE"), nullable=False)
-    owner = relationship("User")
+    # always loaded with joinedload() in the queries, a lazy load here would be
+    # one SELECT per post (and can't happen on an AsyncSession anyway)
+    owner = relationship("User", lazy="raise_on_sql")
+    # denormalized count of rows in votes, kept in sync by create_vote
+    vote_count = Column(Integer, server_default='0', nullable=False)
+    votes = synonym("vote_count")
+    # bumped with vote_count, trending.refresh_scores() picks up these posts
+    votes_changed_at = Column(TIMESTAMP(timezone=True),
+                              server_default=text('NOW()'), nullable=False, index=True)
+    # maintained by postgres, only used in WHERE / ORDER BY so never loaded
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "to_tsvector('english', title || ' ' || content)", persisted=True)))
+    # start of content, filled in by with_expression() when ?fields= asks for
+    # an excerpt so the full content never leaves postgres. None otherwise.
+    excerpt = query_expression()
+
+    __table_args__ = (
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        Index("ix_posts_search_vector", "search_vector", postgresql_using="gin"),
+        # newest posts of one author, for fan-out on read / follow backfill
+        Index("ix_posts_owner_id_created_at_id", "owner_id", "created_at", "id"),
+    )
 
 
 class User(Base):
@@ -28,9 +50,17 @@ class User(Base):
     password = Column(String, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True),
                         server_default=text('NOW()'), nullable=False)
+    # denormalized count of rows in follows, kept in sync by the follow route
+    follower_count = Column(Integer, server_default='0', nullable=False)
     refresh_tokens = relationship("RefreshToken", back_populates="user")
 
 
+def load_owner():
+    """joinedload of Posts.owner with only the columns UserResponse shows, the
+    password hash and the counters stay in postgres"""
+    return joinedload(Posts.owner).load_only(User.id, User.email, User.created_at)
+
+
 class Vote(Base):
     __tablename__ = "votes"
 
@@ -38,17 +68,69 @@ class Vote(Base):
         "posts.id", ondelete="CASCADE"), primary_key=True, nullable=False)
     user_id = Column(Integer, ForeignKey(
         "users.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True),
+                        server_default=text('NOW()'), nullable=False)
+
+
+class PostScore(Base):
+    """Precomputed hot score per post, kept up to date by app.trending"""
+    __tablename__ = "post_scores"
+
+    post_id = Column(Integer, ForeignKey(
+        "posts.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    score = Column(Float, nullable=False)
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_post_scores_score_post_id", "score", "post_id"),
+    )
+
+
+class Follow(Base):
+    __tablename__ = "follows"
+
+    follower_id = Column(Integer, ForeignKey(
+        "users.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    followee_id = Column(Integer, ForeignKey(
+        "users.id", ondelete="CASCADE"), primary_key=True, nullable=False, index=True)
+    created_at = Column(TIMESTAMP(timezone=True),
+                        server_default=text('NOW()'), nullable=False)
+
+
+class TimelineEntry(Base):
+    """One post id in a user's precomputed home timeline (see app.timeline)"""
+    __tablename__ = "timelines"
+
+    user_id = Column(Integer, ForeignKey(
+        "users.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    post_id = Column(Integer, ForeignKey(
+        "posts.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    # copy of posts.created_at so the feed is a range scan on one index
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_timelines_user_id_created_at_post_id", "user_id", "created_at", "post_id"),
+    )
 
 
 class RefreshToken(Base):
     __tablename__ = "refresh_tokens"
     
     id = Column(Integer, primary_key=True)
-    token = Column(String, unique=True, index=True)
+    token = Column(String)
     user_id = Column(Integer, ForeignKey("users.id"))
     expires_at = Column(DateTime)
     is_active = Column(Boolean, default=True)
     created_at = Column(TIMESTAMP(timezone=True),
                         server_default=text('NOW()'), nullable=False)
     
-    user = relationship("User", back_populates="refresh_tokens")
\ No newline at end of file
+    user = relationship("User", back_populates="refresh_tokens")
+
+    __table_args__ = (
+        # only live tokens are ever looked up, revoked ones drop out of the
+        # index right away and out of the table at the next compaction
+        Index("ix_refresh_tokens_active_token", "token", unique=True,
+              postgresql_where=text("is_active")),
+        Index("ix_refresh_tokens_active_expires_at", "expires_at",
+              postgresql_where=text("is_active")),
+    )
\ No newline at end of file
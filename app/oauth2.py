@@ -1,12 +1,18 @@
+import asyncio
 import secrets
+from typing import Optional
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.security.utils import get_authorization_scheme_param
 from fastapi import Depends, HTTPException, status
 from jose import JWTError, jwt
 from datetime import datetime, timedelta, timezone
 
-from requests import Session
-from . import schemas , models
-from .database import get_db
+from sqlalchemy import delete, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from . import cache, models
+from .database import AsyncSession_local, get_async_db
 from .config import settings  # Make sure settings is imported from your config module
 
 # OAuth2 scheme for token extraction from requests
@@ -17,6 +23,10 @@ SECRET_KEY = settings.secret_key
 ALGORITHM = settings.algorithm
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 
+# authenticated user rows, keyed by user id, so most requests skip the users lookup
+user_cache = cache.Cache("user", cache.make_backend(settings.user_cache_max_size),
+                         ttl=settings.user_cache_ttl_seconds)
+
 
 def create_access_token(data: dict):
     
@@ -27,16 +37,29 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
-def verify_access_token(token: str, credentials_exception, db):
+def token_user_id(authorization: Optional[str]) -> Optional[int]:
+    """user_id from an "Authorization: Bearer ..." header, without touching
+    the database. None when there is no valid token."""
+    scheme, token = get_authorization_scheme_param(authorization)
+    if scheme.lower() != "bearer":
+        return None
+    try:
+        user_id = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("user_id")
+        return None if user_id is None else int(user_id)
+    except (JWTError, ValueError):
+        return None
+
+
+async def verify_access_token(token: str, credentials_exception, db: AsyncSession):
   
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = str(payload.get("user_id"))
+        user_id = payload.get("user_id")
         
         if user_id is None:
             raise credentials_exception
                # 🔍 CRITICAL FIX: Get actual user from database
-        user = db.query(models.User).filter(models.User.id == user_id).first()
+        user = await load_user(int(user_id), db)
         if user is None:
             raise credentials_exception
         
@@ -45,24 +68,52 @@ def verify_access_token(token: str, credentials_exception, db):
     return user  # Return User object, not TokenData!
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db) ):
+async def load_user(user_id: int, db: AsyncSession):
+    """Get a user through user_cache, falling back to the database on a miss"""
+
+    cached = await user_cache.get(user_id)
+    if cached is not None:
+        user = models.User(id=cached["id"], email=cached["email"],
+                           created_at=datetime.fromisoformat(cached["created_at"]))
+        # detached (not transient) so attaching it to a new post doesn't INSERT it
+        make_transient_to_detached(user)
+        return user
+
+    user = await db.get(models.User, user_id)
+    if user is not None:
+        await user_cache.set(user_id, {"id": user.id, "email": user.email,
+                                       "created_at": user.created_at.isoformat()})
+    return user
+
+
+async def invalidate_user(user_id: int):
+    """Drop a cached user, call this whenever the user row or their tokens change"""
+    await user_cache.invalidate(user_id)
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db) ):
     
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    return verify_access_token(token, credentials_exception, db)
+    return await verify_access_token(token, credentials_exception, db)
+
+
+def utc_now():
+    """refresh_tokens.expires_at is a naive column, so keep everything in naive UTC"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
-def create_refresh_token(user_id: int, db: Session):
+async def create_refresh_token(user_id: int, db: AsyncSession):
     """Create a new refresh token and save to database"""
     
     # Generate a random string (like a serial number)
     token_value = secrets.token_urlsafe(32)
     
     # Set expiry (7 days from now)
-    expires_at = datetime.now(timezone.utc) + timedelta(days=7)
+    expires_at = utc_now() + timedelta(days=7)
     
     # Create database record
     db_token = models.RefreshToken(
@@ -72,28 +123,71 @@ def create_refresh_token(user_id: int, db: Session):
     )
     
     db.add(db_token)
-    db.commit()
+    await db.commit()
     
     return token_value
 
-def validate_refresh_token(token: str, db: Session):
-    """Check if refresh token is valid and not expired"""
-    
-    db_token = db.query(models.RefreshToken).filter(
-        models.RefreshToken.token == token,
-        models.RefreshToken.is_active == True,
-        models.RefreshToken.expires_at > datetime.now(timezone.utc)
-    ).first()
-    
-    return db_token
-
-def revoke_refresh_token(token: str, db: Session):
+async def revoke_refresh_token(token: str, db: AsyncSession):
     """Make a refresh token unusable"""
     
-    db_token = db.query(models.RefreshToken).filter(
-        models.RefreshToken.token == token
-    ).first()
-    
-    if db_token:
-        db_token.is_active = False
-        db.commit()
\ No newline at end of file
+    user_id = await db.scalar(
+        update(models.RefreshToken)
+        .where(models.RefreshToken.token == token, models.RefreshToken.is_active == True)
+        .values(is_active=False)
+        .returning(models.RefreshToken.user_id)
+    )
+    await db.commit()
+    if user_id is not None:
+        await invalidate_user(user_id)
+
+
+async def rotate_refresh_token(token: str, db: AsyncSession):
+    """Swap a valid refresh token for a new one, returns (user_id, new token)
+    or None if the old one was invalid, expired or already used.
+
+    Revoking the old token and inserting the new one is one statement (a
+    data-modifying CTE), so it's one round trip and either both happen or
+    neither. Two requests racing with the same token serialize on the row
+    lock and the second one gets None."""
+    T = models.RefreshToken
+    new_token = secrets.token_urlsafe(32)
+    old = (
+        update(T)
+        .where(T.token == token, T.is_active == True, T.expires_at > utc_now())
+        .values(is_active=False)
+        .returning(T.user_id)
+        .cte("old")
+    )
+    user_id = await db.scalar(
+        insert(T)
+        .from_select(["token", "user_id", "expires_at", "is_active"],
+                     select(literal(new_token), old.c.user_id,
+                            literal(utc_now() + timedelta(days=7)), literal(True)))
+        .returning(T.user_id)
+    )
+    await db.commit()
+    if user_id is None:
+        return None
+    await invalidate_user(user_id)
+    return user_id, new_token
+
+
+async def compact_refresh_tokens():
+    """Delete revoked and expired refresh tokens, batch by batch so no single
+    transaction holds many row locks"""
+    T = models.RefreshToken
+    batch_size = settings.refresh_token_compact_batch_size
+    while True:
+        async with AsyncSession_local() as db:
+            doomed = (
+                select(T.id)
+                .where(or_(T.is_active.is_not(True), T.expires_at <= utc_now()))
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            result = await db.execute(delete(T).where(T.id.in_(doomed.scalar_subquery())))
+            await db.commit()
+        if result.rowcount < batch_size:
+            return
+        # let requests have the connection between batches
+        await asyncio.sleep(0)
\ No newline at end of file
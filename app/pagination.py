@@ -0,0 +1,58 @@
+import base64
+import binascii
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+from .config import settings
+
+
+def _encode(*parts) -> str:
+    raw = "|".join(str(part) for part in parts).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode(cursor: str, *types):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        parts = base64.urlsafe_b64decode(padded).decode().split("|")
+        if len(parts) != len(types):
+            raise ValueError
+        return tuple(convert(part) for convert, part in zip(types, parts))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid cursor")
+
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """Turn the (created_at, id) of the last row on a page into an opaque cursor"""
+    return _encode(created_at.isoformat(), id)
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Reverse of encode_cursor, raises 400 if the client sent garbage"""
+    return _decode(cursor, datetime.fromisoformat, int)
+
+
+def encode_rank_cursor(rank: float, id: int) -> str:
+    """Cursor for search results, which are ordered by (rank, id)"""
+    return _encode(repr(rank), id)
+
+
+def decode_rank_cursor(cursor: str) -> tuple[float, int]:
+    return _decode(cursor, float, int)
+
+
+def clamp_limit(limit: int) -> int:
+    """?limit= kept between 1 and posts_page_max_limit"""
+    return max(1, min(limit, settings.posts_page_max_limit))
+
+
+def next_page(results, limit: int, make_cursor):
+    """List routes fetch limit + 1 rows just to know whether there is a next
+    page. Returns the first limit rows and the cursor for the next page
+    (make_cursor(last row)), or None when this is the last one."""
+    if len(results) <= limit:
+        return results, None
+    results = results[:limit]
+    return results, make_cursor(results[-1])
@@ -0,0 +1,56 @@
+import logging
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_statements: int):
+    """Declare how many SQL statements one call of this route may run"""
+    def decorator(endpoint):
+        endpoint.__query_budget__ = max_statements
+        return endpoint
+    return decorator
+
+
+class QueryBudgetMiddleware:
+    """Counts the statements each request runs (through the engine events in
+    metrics.instrument_engine) and complains when a route goes over its
+    declared budget. In "raise" mode the error reaches the test client, so an
+    N+1 that sneaks in fails the test run instead of just getting slower."""
+
+    def __init__(self, app, mode: str = "log"):
+        self.app = app
+        self.mode = mode
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # share the counter with MetricsMiddleware when both are on
+        timings = metrics.current_timings.get()
+        token = None
+        if timings is None:
+            timings = metrics.RequestTimings()
+            token = metrics.current_timings.set(timings)
+        before = timings.statements
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if token is not None:
+                metrics.current_timings.reset(token)
+
+        budget = getattr(scope.get("endpoint"), "__query_budget__", None)
+        used = timings.statements - before
+        if budget is None or used <= budget:
+            return
+        route = getattr(scope.get("route"), "path", scope["path"])
+        message = f"{scope['method']} {route} ran {used} SQL statements, budget is {budget}"
+        if self.mode == "raise":
+            raise QueryBudgetExceeded(message)
+        logger.error(message)
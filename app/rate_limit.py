@@ -0,0 +1,141 @@
+import math
+import time
+from collections import OrderedDict
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security.oauth2 import OAuth2PasswordRequestForm
+
+from . import oauth2
+from .config import settings
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_limit(limit: str) -> tuple[int, float]:
+    """"10/minute" -> (bucket capacity 10, refill of 10/60 tokens per second)"""
+    count, _, period = limit.partition("/")
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period.strip()]
+
+
+class RateLimitBackend:
+    """Token buckets behind the limiter. Swap MemoryRateLimitBackend for
+    RedisRateLimitBackend to share the limits between workers / hosts."""
+
+    async def hit(self, key: str, capacity: int, refill_rate: float) -> float:
+        """Take one token from the bucket, returns 0 if there was one, else
+        the seconds until the next token"""
+        raise NotImplementedError
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Per-process buckets, least recently used ones are forgotten (a
+    forgotten bucket just starts full again)"""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def hit(self, key, capacity, refill_rate):
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * refill_rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / refill_rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+# refill and take in one round trip, redis' own clock so workers agree
+_REDIS_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(wait)
+"""
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """Buckets shared by every worker"""
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("rate_limit_redis_url is set but the redis package is not installed")
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(_REDIS_BUCKET)
+
+    async def hit(self, key, capacity, refill_rate):
+        return float(await self._script(keys=[f"ratelimit:{key}"], args=[capacity, refill_rate]))
+
+
+def make_backend() -> RateLimitBackend:
+    if settings.rate_limit_redis_url:
+        return RedisRateLimitBackend(settings.rate_limit_redis_url)
+    return MemoryRateLimitBackend(settings.rate_limit_max_keys)
+
+
+backend = make_backend()
+
+
+def client_ip(request: Request) -> str:
+    if settings.rate_limit_trust_forwarded_for:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def check(key: str, capacity: int, refill_rate: float):
+    """429 if the bucket for key is empty"""
+    if not settings.rate_limit_enabled:
+        return
+    wait = await backend.hit(key, capacity, refill_rate)
+    if wait > 0:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail="Too many requests, slow down",
+                            headers={"Retry-After": str(math.ceil(wait))})
+
+
+# Policies are attached to routes as dependencies, route level dependencies
+# run before the endpoint's own so a limited request never gets to bcrypt or
+# the database. Routes sharing a scope share the bucket.
+
+def limit_by_ip(scope: str, limit: str):
+    rate = parse_limit(limit)
+
+    async def dependency(request: Request):
+        await check(f"{scope}:ip:{client_ip(request)}", *rate)
+    return Depends(dependency)
+
+
+def limit_by_username(scope: str, limit: str):
+    """For the login form, so one account can't be guessed at from many IPs"""
+    rate = parse_limit(limit)
+
+    async def dependency(form: OAuth2PasswordRequestForm = Depends()):
+        await check(f"{scope}:username:{form.username.lower()}", *rate)
+    return Depends(dependency)
+
+
+def limit_by_user(scope: str, limit: str):
+    rate = parse_limit(limit)
+
+    async def dependency(current_user=Depends(oauth2.get_current_user)):
+        await check(f"{scope}:user:{current_user.id}", *rate)
+    return Depends(dependency)
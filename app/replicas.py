@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from fastapi import Request
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from starlette.datastructures import Headers
+
+from . import cache, oauth2
+from .config import settings
+from .database import admitted_session, async_engine, make_async_engine, pool_status
+
+logger = logging.getLogger(__name__)
+
+# set on responses to writes, while it's there the client reads from the
+# primary so it sees its own write even if the replicas haven't replayed it
+READ_PRIMARY_COOKIE = "read_primary"
+
+# the same for API clients that don't keep cookies: user ids that wrote in the
+# last read_your_writes_seconds. Only shared between workers when
+# cache_redis_url is set, otherwise a read served by another worker than the
+# write can still hit a replica.
+recent_writers = cache.Cache("recent-write", cache.make_backend(settings.user_cache_max_size),
+                             ttl=settings.read_your_writes_seconds)
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# seconds the replica is behind, 0 when it has replayed everything it received
+# (an idle primary doesn't make a caught up replica look stale). NULL on a
+# server that isn't in recovery, which is fine too.
+_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class Replica:
+    def __init__(self, engine_url: str):
+        url = make_url(engine_url)
+        self.engine = make_async_engine(url.set(drivername=settings.database_async_driver_name))
+        self.name = url.render_as_string(hide_password=True)
+        # unhealthy until the first check says otherwise
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.checked_at: Optional[float] = None
+
+
+class ReplicaSet:
+    """Read replicas, handed out round robin among the healthy ones. The
+    primary serves reads when there are none (or none healthy)."""
+
+    def __init__(self, urls: list[str]):
+        self.replicas = [Replica(u) for u in urls]
+        self._next = 0
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def pick(self):
+        """Engine for the next read"""
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self._next % len(self.replicas)]
+            self._next += 1
+            if replica.healthy:
+                return replica.engine
+        return async_engine
+
+    async def _lag(self, replica: Replica):
+        async with replica.engine.connect() as conn:
+            return await conn.scalar(_LAG_SQL)
+
+    async def _check(self, replica: Replica):
+        try:
+            # the timeout covers connecting too, an unreachable host would
+            # otherwise hang here for asyncpg's 60s connect timeout
+            lag = await asyncio.wait_for(self._lag(replica), timeout=settings.replica_health_timeout)
+            lag = float(lag or 0)
+            healthy = lag <= settings.replica_max_lag_seconds
+        except Exception as e:
+            lag, healthy = None, False
+            logger.debug("Replica %s health check failed: %r", replica.name, e)
+        if healthy and not replica.healthy:
+            logger.info("Replica %s is healthy (lag %s)", replica.name, lag)
+        elif replica.healthy and not healthy:
+            logger.warning("Replica %s taken out of rotation (lag %s)", replica.name, lag)
+        replica.healthy, replica.lag, replica.checked_at = healthy, lag, time.time()
+
+    async def check(self):
+        """Health check every replica, run by a PeriodicTask from main.lifespan"""
+        await asyncio.gather(*(self._check(replica) for replica in self.replicas))
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def status(self) -> list[dict]:
+        return [{"replica": r.name, "healthy": r.healthy, "lag_seconds": r.lag,
+                 "pool": pool_status(r.engine)} for r in self.replicas]
+
+
+replicas = ReplicaSet(settings.database_replica_urls)
+
+
+async def read_engine(request: Request):
+    """Replica for this read, or the primary right after this client (by
+    cookie or by access token) wrote"""
+    if not replicas or READ_PRIMARY_COOKIE in request.cookies:
+        return async_engine
+    user_id = oauth2.token_user_id(request.headers.get("authorization"))
+    if user_id is not None and await recent_writers.get(user_id) is not None:
+        return async_engine
+    return replicas.pick()
+
+
+async def get_read_db(request: Request):
+    """get_async_db for read-only routes"""
+    async with admitted_session(await read_engine(request)) as db:
+        yield db
+
+
+class ReadYourWritesMiddleware:
+    """Marks clients that just wrote something so their reads stick to the
+    primary for read_your_writes_seconds: a cookie for browsers, plus the
+    user id in recent_writers for Bearer token clients"""
+
+    def __init__(self, app):
+        self.app = app
+        self.cookie = (f"{READ_PRIMARY_COOKIE}=1; Max-Age={settings.read_your_writes_seconds}; "
+                       "Path=/; HttpOnly; SameSite=Lax").encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                message["headers"] = [*message.get("headers", []), (b"set-cookie", self.cookie)]
+                if replicas:
+                    user_id = oauth2.token_user_id(Headers(scope=scope).get("authorization"))
+                    if user_id is not None:
+                        await recent_writers.set(user_id, 1)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,29 +1,46 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from .. import models, schemas, utils, oauth2
-from ..database import get_db
+from ..config import settings
+from ..database import get_async_db
+from ..rate_limit import limit_by_ip, limit_by_username
+from ..query_budget import query_budget
 
 router = APIRouter(
     tags=["Authentication"]
 )
 
-@router.post("/login", response_model=schemas.Token)
-def login(response: Response, user: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user_data = db.query(models.User).filter(models.User.email == user.username).first()
+@router.post("/login", response_model=schemas.Token,
+             dependencies=[limit_by_ip("login", settings.rate_limit_login_ip),
+                           limit_by_username("login", settings.rate_limit_login_username)])
+@query_budget(3)  # user, rehash UPDATE, refresh token INSERT
+async def login(response: Response, user: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(models.User).where(models.User.email == user.username))
+    user_data = result.scalars().first()
     if not user_data:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Invaild credentials")
+    # give the connection back to the pool while bcrypt runs
+    await db.commit()
     
-    if not utils.verify(user.password, user_data.password):
+    verified, new_hash = await utils.verify_password(user.password, user_data.password)
+    if not verified:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Incorrect password ")
+
+    # stored hash was made with an older bcrypt cost, upgrade it while we have the password
+    if new_hash:
+        user_data.password = new_hash
+        await db.commit()
+        await oauth2.invalidate_user(user_data.id)
         
     # create token 
     # token
     access_token = oauth2.create_access_token(data={"user_id": user_data.id})
     
-    refresh_token = oauth2.create_refresh_token(user_data.id, db)
+    refresh_token = await oauth2.create_refresh_token(user_data.id, db)
         
         # Set refresh token as HTTP-only cookie
     response.set_cookie(
@@ -36,8 +53,9 @@ def login(response: Response, user: OAuth2PasswordRequestForm = Depends(), db: S
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@router.post("/refresh")
-def refresh_access_token(request: Request, response: Response, db: Session = Depends(get_db)):
+@router.post("/refresh", dependencies=[limit_by_ip("refresh", settings.rate_limit_refresh_ip)])
+@query_budget(1)
+async def refresh_access_token(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
     
     # Get refresh token from cookie
     refresh_token = request.cookies.get("refresh_token")
@@ -45,24 +63,18 @@ def refresh_access_token(request: Request, response: Response, db: Session = Dep
     if not refresh_token:
         raise HTTPException(status_code=401, detail="No refresh token provided")
     
-    # Validate the refresh token
-    db_token = oauth2.validate_refresh_token(refresh_token, db)
+    # 🔄 TOKEN ROTATION MAGIC: the old token is revoked and the new one
+    # stored in one statement, an invalid / expired / reused token gets None
+    rotated = await oauth2.rotate_refresh_token(refresh_token, db)
     
-    if not db_token:
+    if not rotated:
         raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
+    user_id, new_refresh_token = rotated
     
-    # 🔄 TOKEN ROTATION MAGIC STARTS HERE
-    
-    # 1. Revoke the old refresh token (security!)
-    oauth2.revoke_refresh_token(refresh_token, db)
-    
-    # 2. Create a brand new access token
-    new_access_token = oauth2.create_access_token(data={"user_id": db_token.user_id})
-    
-    # 3. Create a brand new refresh token
-    new_refresh_token = oauth2.create_refresh_token(db_token.user_id, db)
+    # Create a brand new access token
+    new_access_token = oauth2.create_access_token(data={"user_id": user_id})
     
-    # 4. Set the new refresh token as cookie
+    # Set the new refresh token as cookie
     response.set_cookie(
         key="refresh_token",
         value=new_refresh_token,
@@ -78,14 +90,15 @@ def refresh_access_token(request: Request, response: Response, db: Session = Dep
     }
     
 @router.post("/logout")
-def logout(request: Request, response: Response, db: Session = Depends(get_db)):
+@query_budget(1)
+async def logout(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
     
     # Get refresh token from cookie
     refresh_token = request.cookies.get("refresh_token")
     
     if refresh_token:
         # Revoke it in database
-        oauth2.revoke_refresh_token(refresh_token, db)
+        await oauth2.revoke_refresh_token(refresh_token, db)
     
     # Clear the cookie
     response.delete_cookie("refresh_token")
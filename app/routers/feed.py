@@ -0,0 +1,27 @@
+from typing import Optional
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import metrics, schemas, oauth2, timeline
+from ..config import settings
+from ..replicas import get_read_db
+from ..pagination import clamp_limit, decode_cursor, encode_cursor, next_page
+from ..query_budget import query_budget
+
+router = APIRouter(
+    prefix="/feed",
+    tags=["Feed"]
+)
+
+
+@router.get("/", response_model=schemas.PostPage)
+@query_budget(2)  # user, the page
+async def get_feed(db: AsyncSession = Depends(get_read_db), current_user=Depends(oauth2.get_current_user),
+                   limit: int = settings.posts_page_default_limit, after: Optional[str] = None):
+    limit = clamp_limit(limit)
+    cursor = decode_cursor(after) if after else None
+
+    # one extra row to know whether there is a next page
+    results = (await db.execute(timeline.feed_query(current_user.id, limit + 1, cursor))).scalars().all()
+    results, next_cursor = next_page(results, limit, lambda post: encode_cursor(post.created_at, post.id))
+
+    return metrics.TimedJSONResponse({"data": [schemas.post_response(post) for post in results], "next_cursor": next_cursor})
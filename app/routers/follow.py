@@ -0,0 +1,69 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import delete, literal, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas, oauth2, timeline
+from ..config import settings
+from ..database import get_async_db
+from ..query_budget import query_budget
+from ..rate_limit import limit_by_user
+
+router = APIRouter(
+    prefix="/follows",
+    tags=["Follows"]
+)
+
+
+async def bump_follower_count(db: AsyncSession, user_id: int, delta: int):
+    """Add delta to users.follower_count and return the new count"""
+    return await db.scalar(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(follower_count=models.User.follower_count + delta)
+        .returning(models.User.follower_count)
+    )
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED,
+             dependencies=[limit_by_user("write", settings.rate_limit_write_user)])
+@query_budget(5)  # user, INSERT, counter UPDATE, timeline backfill + trim
+async def follow(follow: schemas.Follow, db: AsyncSession = Depends(get_async_db), current_user=Depends(oauth2.get_current_user)):
+    if follow.user_id == current_user.id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="You can't follow yourself")
+
+    follow_filter = (models.Follow.follower_id == current_user.id,
+                     models.Follow.followee_id == follow.user_id)
+    if follow.dir == 1:
+        # only inserts when the user exists and isn't followed yet
+        added = await db.scalar(
+            insert(models.Follow)
+            .from_select(["follower_id", "followee_id"],
+                         select(literal(current_user.id), models.User.id).where(models.User.id == follow.user_id))
+            .on_conflict_do_nothing()
+            .returning(models.Follow.followee_id)
+        )
+        if added is None:
+            await db.rollback()
+            exists = await db.scalar(select(models.User.id).where(models.User.id == follow.user_id))
+            if exists is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail=f"User with id {follow.user_id} not found")
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="Already following this user")
+        follower_count = await bump_follower_count(db, follow.user_id, 1)
+        # big accounts are read into the feed at request time, nothing to copy
+        if follower_count < settings.fanout_max_followers:
+            await timeline.backfill(db, current_user.id, follow.user_id)
+        await db.commit()
+        return {"message": "Followed successfully"}
+    else:
+        removed = await db.scalar(delete(models.Follow).where(*follow_filter).returning(models.Follow.followee_id))
+        if removed is None:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="Not following this user")
+        await bump_follower_count(db, follow.user_id, -1)
+        await timeline.remove_author(db, current_user.id, follow.user_id)
+        await db.commit()
+        return {"message": "Unfollowed successfully"}
@@ -0,0 +1,29 @@
+from fastapi import APIRouter
+from .. import cache, oauth2
+from ..database import async_engine, pool_status
+from ..replicas import replicas
+from ..vote_hub import hub
+
+router = APIRouter(
+    prefix="/internal",
+    tags=["Internal"],
+    include_in_schema=False
+)
+
+
+@router.get("/pool")
+async def get_pool_status():
+    status = pool_status(async_engine)
+    if replicas:
+        status["replicas"] = replicas.status()
+    return status
+
+
+@router.get("/cache")
+async def get_cache_status():
+    return {"user": oauth2.user_cache.stats(), "posts": cache.post_cache.stats()}
+
+
+@router.get("/live")
+async def get_live_status():
+    return hub.stats()
@@ -0,0 +1,108 @@
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import metrics, models
+from ..config import settings
+from ..database import admitted_session, async_engine, get_async_db
+from ..query_budget import query_budget
+from ..vote_hub import SubscriberDropped, Subscription, hub
+
+# Live vote counts, so clients don't have to poll GET /posts/{id}. Both
+# variants send the current count first, then every change (at most one per
+# live_interval seconds) as {"post_id": ..., "votes": ...}.
+#
+# The first count comes from the primary like the ones VoteHub.tick() reads
+# later: a lagging replica could hand out a count older than a change whose
+# update was already pushed (or that happened before subscribing), and the
+# client would show it until the next vote.
+
+router = APIRouter(
+    prefix="/posts",
+    tags=["Posts"]
+)
+
+
+async def vote_count(db: AsyncSession, id: int):
+    return await db.scalar(select(models.Posts.vote_count).where(models.Posts.id == id))
+
+
+def sse_event(update: dict) -> bytes:
+    return b"event: votes\ndata: " + metrics.dumps(update) + b"\n\n"
+
+
+async def sse_stream(subscription: Subscription, votes: int):
+    try:
+        yield sse_event({"post_id": subscription.post_id, "votes": votes})
+        while True:
+            update = await subscription.next(settings.live_heartbeat_seconds)
+            # a comment line keeps proxies from closing an idle stream
+            yield b": ping\n\n" if update is None else sse_event(update)
+    except SubscriberDropped:
+        # the client was too slow, EventSource reconnects on its own
+        pass
+    finally:
+        hub.unsubscribe(subscription)
+
+
+@router.get("/{id}/live")
+@query_budget(1)
+async def live_votes(id: int, db: AsyncSession = Depends(get_async_db)):
+    """Server-Sent Events with the post's vote count"""
+    # subscribed before reading the count, so no change falls in between
+    subscription = hub.subscribe(id)
+    if subscription is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many live subscribers, try again later",
+                            headers={"Retry-After": "5"})
+    votes = await vote_count(db, id)
+    if votes is None:
+        hub.unsubscribe(subscription)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Post with id {id} not found")
+    return StreamingResponse(sse_stream(subscription, votes), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.websocket("/{id}/live/ws")
+async def live_votes_ws(websocket: WebSocket, id: int):
+    """The same updates over a WebSocket, one JSON text message each"""
+    subscription = hub.subscribe(id)
+    if subscription is None:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too many live subscribers")
+        return
+    try:
+        async with admitted_session(async_engine) as db:
+            votes = await vote_count(db, id)
+        if votes is None:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=f"Post with id {id} not found")
+            return
+
+        await websocket.accept()
+
+        async def until_disconnect():
+            # nothing is expected from the client, this is only here to notice it left
+            try:
+                while (await websocket.receive())["type"] != "websocket.disconnect":
+                    pass
+            finally:
+                subscription.drop()
+
+        watcher = asyncio.create_task(until_disconnect())
+        try:
+            await websocket.send_text(metrics.dumps({"post_id": id, "votes": votes}).decode())
+            while True:
+                update = await subscription.next(settings.live_heartbeat_seconds)
+                if update is not None:
+                    await websocket.send_text(metrics.dumps(update).decode())
+        except SubscriberDropped:
+            if not watcher.done():
+                # dropped for being too slow, not because it went away
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too slow")
+        except WebSocketDisconnect:
+            pass
+        finally:
+            watcher.cancel()
+    finally:
+        hub.unsubscribe(subscription)
@@ -1,47 +1,259 @@
 from re import L
-from fastapi import APIRouter, Depends, HTTPException, status, Body
-from sqlalchemy import func
-from sqlalchemy.orm import Session 
-from .. import models, schemas, oauth2
-from ..database import get_db 
+import zlib
+from typing import Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, status, Body
+from fastapi.responses import StreamingResponse
+from pydantic import AwareDatetime
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only, with_expression
+from sqlalchemy.orm.attributes import set_committed_value
+from .. import cache, metrics, models, schemas, oauth2, timeline
+from ..config import settings
+from ..database import admitted_session, async_engine, check_admission, get_async_db
+from ..replicas import get_read_db, read_engine
+from ..query_budget import query_budget
+from ..rate_limit import limit_by_user
+from ..pagination import clamp_limit, decode_cursor, decode_rank_cursor, encode_cursor, encode_rank_cursor, next_page
+from .vote import vote_buffer
 
 router = APIRouter(
     prefix="/posts",
     tags=["Posts"]
 )
 
+# Posts columns behind each ?fields= name, id and created_at are always
+# loaded (the cursor and the cache tags need them)
+FIELD_COLUMNS = {
+    "title": [models.Posts.title],
+    "content": [models.Posts.content],
+    "excerpt": [],
+    "published": [models.Posts.published],
+    "contact": [models.Posts.contact],
+    "created_at": [],
+    "owner_id": [models.Posts.owner_id],
+    "owner": [models.Posts.owner_id],
+    "votes": [models.Posts.vote_count],
+}
+
+
+def post_fields(fields: Optional[str] = Query(
+        None, description=f"Comma separated subset of {', '.join(schemas.POST_FIELDS)}, everything but excerpt by default",
+)) -> Optional[tuple[str, ...]]:
+    """?fields= as names in POST_FIELDS order, so title,votes and votes,title
+    share a cache entry"""
+    if fields is None:
+        return None
+    names = {name.strip() for name in fields.split(",")} - {""}
+    unknown = names - schemas.POST_FIELDS.keys()
+    if unknown or not names:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unknown fields {', '.join(sorted(unknown)) or '(none given)'}, "
+                                   f"pick from {', '.join(schemas.POST_FIELDS)}")
+    return tuple(name for name in schemas.POST_FIELDS if name in names)
+
+
+def select_posts(fields: Optional[tuple[str, ...]] = None):
+    """SELECT of Posts that reads only the columns fields needs (all of them
+    with the owner when fields is None)"""
+    owner = models.load_owner()
+    if fields is None:
+        return select(models.Posts).options(owner)
+    columns = [column for name in fields for column in FIELD_COLUMNS[name]]
+    query = select(models.Posts).options(load_only(models.Posts.created_at, *columns))
+    if "owner" in fields:
+        query = query.options(owner)
+    if "excerpt" in fields:
+        query = query.options(with_expression(
+            models.Posts.excerpt, func.left(models.Posts.content, settings.post_excerpt_length)))
+    return query
+
+
 # @router.get("/", response_model=list[schemas.PostResponse])
-@router.get("/",  response_model=list[schemas.PostResponse])
-async def Post(db: Session = Depends(get_db)):
+@router.get("/",  response_model=schemas.PostPage)
+@query_budget(5)  # the page, plus a buffered vote flush (3) and the reload when write-behind is on
+async def Post(request: Request, db: AsyncSession = Depends(get_read_db), limit: int = settings.posts_page_default_limit, after: Optional[str] = None,
+               fields: Optional[tuple[str, ...]] = Depends(post_fields)):
     # posts = db.query(models.Posts).limit(limit).offset(skip).all()
-    
-    results = db.query(models.Posts, func.count(models.Vote.post_id).label("votes")).join(models.Vote,models.Vote.post_id == models.Posts.id, isouter=True).group_by(models.Posts.id).all()
-    
-    # results = db.query(    models.Posts.title,    func.count(models.Vote.post_id).label("votes")).outerjoin(    models.Vote, models.Vote.ost_id == models.Posts.id).group_by(    models.Posts.id).all()
-    # print(results)
-    
-    # posts_with_votes = [
-    #     {**post.__dict__, "votes": votes}
-    #     for post, votes in results
-    # ]
-    posts_with_votes = [
-    schemas.PostResponse.model_validate(
-        post,
-        from_attributes=True
-    ).model_copy(update={"votes": votes})
-    for post, votes in results
-   ]
-
-    return posts_with_votes
-
-
-@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.PostResponse)
-def create_post(post: schemas.PostParams, db: Session = Depends(get_db), current_user = Depends(oauth2.get_current_user)):
-    new_post = models.Posts(owner_id= current_user.user_id, **post.model_dump())
-    print(current_user)
-    db.add(new_post)
-    db.commit()
-    db.refresh(new_post)
+    limit = clamp_limit(limit)
+
+    # owners come in the same SELECT through a join, no extra query per post
+    query = select_posts(fields).order_by(models.Posts.created_at.desc(), models.Posts.id.desc())
+    if after:
+        created_at, last_id = decode_cursor(after)
+        query = query.where(tuple_(models.Posts.created_at, models.Posts.id) < tuple_(created_at, last_id))
+
+    async def load_page():
+        # keyset pagination straight off the (created_at, id) index, votes come from
+        # the denormalized vote_count column so there is no join / GROUP BY anymore
+        results = (await db.execute(query.limit(limit + 1))).scalars().all()
+
+        # results = db.query(    models.Posts.title,    func.count(models.Vote.post_id).label("votes")).outerjoin(    models.Vote, models.Vote.ost_id == models.Posts.id).group_by(    models.Posts.id).all()
+        # print(results)
+        
+        # posts_with_votes = [
+        #     {**post.__dict__, "votes": votes}
+        #     for post, votes in results
+        # ]
+
+        results, next_cursor = next_page(results, limit, lambda post: encode_cursor(post.created_at, post.id))
+
+        with metrics.track_serialization():
+            body = metrics.dumps({
+                "data": [schemas.post_response(post, fields) for post in results],
+                "next_cursor": next_cursor
+            }).decode()
+        # the page goes stale when any post on it changes, and the first page
+        # also whenever a new post is created
+        tags = [f"post:{post.id}" for post in results]
+        if not after:
+            tags.append("first-page")
+        entry = cache.make_etag_entry(body)
+        entry["post_ids"] = [post.id for post in results]
+        return entry, tags
+
+    # every fields= variant is its own entry (and ETag), all under the same tags
+    key = f"page:{after or ''}:{limit}:{','.join(fields or ['*'])}"
+    entry = await cache.post_cache.get_or_load(key, load_page)
+    # write-behind vote buffer: if this worker still holds votes for posts on
+    # the page, write them and rebuild the page. Other workers' buffers are out
+    # of reach, see VoteBuffer.
+    if vote_buffer.has_pending(entry["post_ids"]):
+        await vote_buffer.flush(entry["post_ids"])
+        # the flush went to the primary, a replica may not have it yet
+        # (load_page picks up the rebound db)
+        async with admitted_session(async_engine) as db:
+            entry = await cache.post_cache.get_or_load(key, load_page)
+    return cache.etag_response(request, entry)
+
+
+@router.get("/search", response_model=schemas.PostPage)
+@query_budget(1)
+async def search_posts(q: str = Query(..., min_length=1), db: AsyncSession = Depends(get_read_db), limit: int = settings.posts_page_default_limit, after: Optional[str] = None):
+    limit = clamp_limit(limit)
+
+    # matches come off the GIN index on search_vector, best ranked first
+    ts_query = func.websearch_to_tsquery("english", q)
+    rank = func.ts_rank(models.Posts.search_vector, ts_query)
+    query = (
+        select(models.Posts, rank)
+        .options(models.load_owner())
+        .where(models.Posts.search_vector.op("@@")(ts_query))
+        .order_by(rank.desc(), models.Posts.id.desc())
+    )
+    if after:
+        last_rank, last_id = decode_rank_cursor(after)
+        query = query.where(tuple_(rank, models.Posts.id) < tuple_(last_rank, last_id))
+
+    results = (await db.execute(query.limit(limit + 1))).all()
+
+    results, next_cursor = next_page(results, limit, lambda row: encode_rank_cursor(row[1], row[0].id))
+
+    # returning a Response skips FastAPI validating the page against response_model again
+    return metrics.TimedJSONResponse({"data": [schemas.post_response(post) for post, _ in results], "next_cursor": next_cursor})
+
+
+@router.get("/trending", response_model=schemas.PostPage)
+@query_budget(1)
+async def trending_posts(db: AsyncSession = Depends(get_read_db), limit: int = settings.posts_page_default_limit, after: Optional[str] = None):
+    limit = clamp_limit(limit)
+
+    # top-N straight off the (score, post_id) index, scores are kept fresh
+    # by trending.refresh_scores() in the background
+    score = models.PostScore.score
+    query = (
+        select(models.Posts, score)
+        .options(models.load_owner())
+        .join(models.PostScore, models.PostScore.post_id == models.Posts.id)
+        .order_by(score.desc(), models.PostScore.post_id.desc())
+    )
+    if after:
+        last_score, last_id = decode_rank_cursor(after)
+        query = query.where(tuple_(score, models.PostScore.post_id) < tuple_(last_score, last_id))
+
+    results = (await db.execute(query.limit(limit + 1))).all()
+
+    results, next_cursor = next_page(results, limit, lambda row: encode_rank_cursor(row[1], row[0].id))
+
+    return metrics.TimedJSONResponse({"data": [schemas.post_response(post) for post, _ in results], "next_cursor": next_cursor})
+
+
+EXPORT_COLUMNS = (
+    models.Posts.id,
+    models.Posts.title,
+    models.Posts.content,
+    models.Posts.published,
+    models.Posts.contact,
+    models.Posts.created_at,
+    models.Posts.owner_id,
+    models.Posts.vote_count.label("votes"),
+)
+
+
+async def export_lines(query, bind):
+    """NDJSON chunks, one per batch of rows off a server-side cursor"""
+    # the request's session is closed before the body gets streamed, so the
+    # export holds its own connection for as long as the download runs, and
+    # counts against admission control for all of it
+    async with admitted_session(bind) as db:
+        result = await db.stream(query.execution_options(yield_per=settings.export_batch_size))
+        async for rows in result.mappings().partitions():
+            yield b"".join(metrics.dumps(dict(row)) + b"\n" for row in rows)
+
+
+async def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@router.get("/export")
+@query_budget(1)
+async def export_posts(request: Request, created_after: Optional[AwareDatetime] = None,
+                       created_before: Optional[AwareDatetime] = None,
+                       owner_id: Optional[int] = None, gzip: bool = False):
+    """Every post with its vote count as NDJSON, oldest first. Pass the last
+    created_at you saw as created_after to export incrementally.
+
+    created_after / created_before need a UTC offset (422 otherwise), a naive
+    time would be read in the server's time zone and skip or repeat rows."""
+    query = select(*EXPORT_COLUMNS).order_by(models.Posts.created_at, models.Posts.id)
+    if created_after is not None:
+        query = query.where(models.Posts.created_at > created_after)
+    if created_before is not None:
+        query = query.where(models.Posts.created_at <= created_before)
+    if owner_id is not None:
+        query = query.where(models.Posts.owner_id == owner_id)
+
+    bind = await read_engine(request)
+    # the body streams after the status line went out, turn the request away now
+    check_admission(bind)
+    body = export_lines(query, bind)
+    headers = {"Content-Disposition": 'attachment; filename="posts.ndjson"'}
+    if gzip:
+        body = gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.PostResponse,
+             dependencies=[limit_by_user("write", settings.rate_limit_write_user)])
+@query_budget(2)  # user, INSERT ... RETURNING
+async def create_post(post: schemas.PostParams, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db), current_user = Depends(oauth2.get_current_user)):
+    # RETURNING brings back the server defaults (id, created_at, ...) so there
+    # is nothing left to refresh
+    new_post = await db.scalar(
+        insert(models.Posts).values(owner_id=current_user.id, **post.model_dump()).returning(models.Posts)
+    )
+    set_committed_value(new_post, "owner", current_user)
+    await db.commit()
+    await cache.post_cache.invalidate_tags("first-page")
+    # followers' timelines are filled in after the response is sent
+    background_tasks.add_task(timeline.fan_out, new_post.id, current_user.id, new_post.created_at)
 #     cursor.execute("""INSERT INTO posts (title, content,published, id ) VALUES (%s, %s, %s,%s) RETURNING *""",
 #                    (post.title, post.content, post.published, randrange(0, 1000000)))
 #     new_post = cursor.fetchone()
@@ -49,73 +261,85 @@ def create_post(post: schemas.PostParams, db: Session = Depends(get_db), current
 #     if not new_post:
 #         raise HTTPException(
 #             status_code=status.HTTP_400_BAD_REQUEST, detail="Post creation failed")
-    return new_post
+    return metrics.TimedJSONResponse(schemas.post_response(new_post), status_code=status.HTTP_201_CREATED)
 
 
 
 @router.get("/{id}", response_model=schemas.PostResponse)
-def get_post(id: int, db: Session = Depends(get_db)):
-    post = (
-        db.query(models.Posts, func.count(models.Vote.post_id).label("votes"))
-        .join(models.Vote, models.Vote.post_id == models.Posts.id, isouter=True)
-        .group_by(models.Posts.id)
-        .filter(models.Posts.id == id)
-        .first()
-    )
+@query_budget(4)  # the post, plus a buffered vote flush (3) when write-behind is on
+async def get_post(id: int, request: Request, db: AsyncSession = Depends(get_read_db),
+                   fields: Optional[tuple[str, ...]] = Depends(post_fields)):
+    flushed = vote_buffer.has_pending([id])
+    if flushed:
+        await vote_buffer.flush([id])
+
+    async def load_post():
+        post = await db.scalar(select_posts(fields).where(models.Posts.id == id))
 
-    if not post:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Post with id {id} not found"
-        )
+        if not post:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Post with id {id} not found"
+            )
 
-    post, votes = post  # ✅ Unpack the tuple (not a loop)
-    response = schemas.PostResponse.model_validate(
-        post,
-        from_attributes=True
-    ).model_copy(update={"votes": votes})
+        with metrics.track_serialization():
+            body = metrics.dumps(schemas.post_response(post, fields)).decode()
+        return cache.make_etag_entry(body), [f"post:{id}"]
 
-    return response
+    key = f"post:{id}:{','.join(fields or ['*'])}"
+    if flushed:
+        # read the votes just written from the primary, not a replica
+        async with admitted_session(async_engine) as db:
+            entry = await cache.post_cache.get_or_load(key, load_post)
+    else:
+        entry = await cache.post_cache.get_or_load(key, load_post)
+    return cache.etag_response(request, entry)
 
 
-@router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_post(id: int, db: Session = Depends(get_db), current_user = Depends(oauth2.get_current_user)):
-    post_query = db.query(models.Posts).filter(models.Posts.id == id)
-    
-    post = post_query.first()
-    if post is None:
+async def raise_not_found_or_forbidden(db: AsyncSession, id: int, action: str):
+    """A write filtered on id and owner matched nothing, find out which
+    of the two it was. Only runs on the error path."""
+    if await db.scalar(select(models.Posts.id).where(models.Posts.id == id)) is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"post with id {id} you are trying to delete is not available")
-        
-    
-    if str(post.owner_id) != str(current_user.user_id):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="Not authorized to perform requested action")
-        
-    
-    post_query.delete(synchronize_session=False)
-    db.commit()
+                            detail=f"post with id {id} you are trying to {action} is not available")
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                        detail="Not authorized to perform requested action")
+
+
+@router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT,
+               dependencies=[limit_by_user("write", settings.rate_limit_write_user)])
+@query_budget(3)  # user, DELETE ... RETURNING, existence check when it matched nothing
+async def delete_post(id: int, db: AsyncSession = Depends(get_async_db), current_user = Depends(oauth2.get_current_user)):
+    deleted = await db.scalar(
+        delete(models.Posts)
+        .where(models.Posts.id == id, models.Posts.owner_id == current_user.id)
+        .returning(models.Posts.id)
+    )
+    if deleted is None:
+        await raise_not_found_or_forbidden(db, id, "delete")
+    await db.commit()
+    await cache.post_cache.invalidate_tags(f"post:{id}")
     # index = find_index_post(id)
     # my_posts.pop(index)
     return {"message": "Post deleted successfully"}
 
 
-@router.put("/{id}", response_model=schemas.PostResponse)
-def update_post(id: int, db: Session = Depends(get_db), post: schemas.PostParams = Body(...),current_user = Depends(oauth2.get_current_user)):
-    post_query = db.query(models.Posts).filter(models.Posts.id == id)
-    existing_post = post_query.first()
-    
-    if existing_post is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"post with id {id} you are trying to update is not available")
-
-    # Check ownership
-    if existing_post.owner_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="Not authorized to perform requested action")
-    post_query.update(post.model_dump(), synchronize_session=False)
-    db.commit()
-    
-    updated_post = post_query.first()
+@router.put("/{id}", response_model=schemas.PostResponse,
+            dependencies=[limit_by_user("write", settings.rate_limit_write_user)])
+@query_budget(3)  # user, UPDATE ... RETURNING, existence check when it matched nothing
+async def update_post(id: int, db: AsyncSession = Depends(get_async_db), post: schemas.PostParams = Body(...),current_user = Depends(oauth2.get_current_user)):
+    updated_post = await db.scalar(
+        update(models.Posts)
+        .where(models.Posts.id == id, models.Posts.owner_id == current_user.id)
+        .values(**post.model_dump())
+        .returning(models.Posts)
+        .execution_options(populate_existing=True)
+    )
+    if updated_post is None:
+        await raise_not_found_or_forbidden(db, id, "update")
+    # the ownership check means the owner is the current user
+    set_committed_value(updated_post, "owner", current_user)
+    await db.commit()
+    await cache.post_cache.invalidate_tags(f"post:{id}")
     # response = schemas.PostResponse.model_validate(updated_post, from_attributes=True)
-    return updated_post
+    return metrics.TimedJSONResponse(schemas.post_response(updated_post))
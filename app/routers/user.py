@@ -1,7 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Body
-from sqlalchemy.orm import Session 
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from .. import models, schemas, utils
-from ..database import get_db
+from ..config import settings
+from ..database import get_async_db
+from ..rate_limit import limit_by_ip
+from ..query_budget import query_budget
 
 router = APIRouter(
     prefix="/user",
@@ -9,17 +13,21 @@ router = APIRouter(
 )
 
 
-@router.post("/",response_model=schemas.UserResponse  ,status_code=status.HTTP_201_CREATED)
-def create_user(user: schemas.CreatUser, db: Session = Depends(get_db)):
-    new_user = models.User(**user.model_dump())
-    
-    hashed_password = utils.hash(new_user.password)
-    new_user.password = hashed_password
-    if db.query(models.User).filter(models.User.email == new_user.email).first():
+@router.post("/",response_model=schemas.UserResponse  ,status_code=status.HTTP_201_CREATED,
+             dependencies=[limit_by_ip("signup", settings.rate_limit_signup_ip)])
+@query_budget(1)  # INSERT ... ON CONFLICT DO NOTHING RETURNING
+async def create_user(user: schemas.CreatUser, db: AsyncSession = Depends(get_async_db)):
+    hashed_password = await utils.hash_password(user.password)
+    # the unique index on email does the existence check, so two signups with
+    # the same email can't both get through
+    new_user = (await db.execute(
+        insert(models.User)
+        .values(email=user.email, password=hashed_password)
+        .on_conflict_do_nothing(index_elements=[models.User.email])
+        .returning(models.User.email)
+    )).first()
+    if new_user is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=f"User with email {new_user.email} already exists")
-    
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+                            detail=f"User with email {user.email} already exists")
+    await db.commit()
     return new_user
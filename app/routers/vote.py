@@ -1,7 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
-from sqlalchemy.orm import Session
-from .. import models, schemas, oauth2
-from ..database import get_db
+from collections import Counter
+from fastapi import APIRouter, Depends, HTTPException, Response, status, Body
+from sqlalchemy import Integer, column, delete, func, literal, select, tuple_, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import cache, models, schemas, oauth2, vote_hub
+from ..config import settings
+from ..database import get_async_db
+from ..query_budget import query_budget
+from ..rate_limit import limit_by_user
+from ..vote_buffer import VoteBuffer
 
 router = APIRouter(
     prefix="/votes",
@@ -9,25 +16,159 @@ router = APIRouter(
 )
 
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-def create_vote(vote: schemas.Vote, db: Session = Depends(get_db), current_user=Depends(oauth2.get_current_user)):
+async def vote_and_count(db: AsyncSession, post_id: int, user_id: int, dir: int) -> bool:
+    """Add (dir 1) or remove a vote and adjust posts.vote_count, one
+    statement: the INSERT/DELETE runs in a CTE and the counter UPDATE only
+    touches the post if that changed a row. Returns False when nothing
+    changed (no such post, vote already there / not there), the caller
+    commits.
+
+    The votes primary key settles two concurrent votes from the same user,
+    only one of them inserts (or deletes) the row."""
+    if dir == 1:
+        changed = (
+            insert(models.Vote)
+            .from_select(["post_id", "user_id"],
+                         select(models.Posts.id, literal(user_id)).where(models.Posts.id == post_id))
+            .on_conflict_do_nothing()
+            .returning(models.Vote.post_id)
+            .cte("changed")
+        )
+    else:
+        changed = (
+            delete(models.Vote)
+            .where(models.Vote.post_id == post_id, models.Vote.user_id == user_id)
+            .returning(models.Vote.post_id)
+            .cte("changed")
+        )
+    result = await db.execute(
+        update(models.Posts)
+        .where(models.Posts.id == changed.c.post_id)
+        .values(vote_count=models.Posts.vote_count + (1 if dir == 1 else -1), votes_changed_at=func.now())
+        .returning(models.Posts.id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.first() is not None
+
+
+async def apply_votes(db: AsyncSession, ups: list[tuple[int, int]], downs: list[tuple[int, int]]):
+    """Apply many (post_id, user_id) votes with set-based statements.
+
+    ups are inserted with one INSERT ... ON CONFLICT DO NOTHING (votes for
+    posts that don't exist are skipped), downs removed with one DELETE, then
+    vote_count is adjusted for every touched post in one UPDATE ... FROM.
+    Returns the (added, deleted) pairs, the caller commits."""
+    added, deleted = set(), set()
+
+    if ups:
+        new_votes = values(column("post_id", Integer), column("user_id", Integer), name="new_votes").data(ups)
+        result = await db.execute(
+            insert(models.Vote)
+            .from_select(["post_id", "user_id"],
+                         select(new_votes.c.post_id, new_votes.c.user_id)
+                         .join(models.Posts, models.Posts.id == new_votes.c.post_id))
+            .on_conflict_do_nothing()
+            .returning(models.Vote.post_id, models.Vote.user_id)
+        )
+        added = set(map(tuple, result.all()))
+
+    if downs:
+        result = await db.execute(
+            delete(models.Vote)
+            .where(tuple_(models.Vote.post_id, models.Vote.user_id).in_(downs))
+            .returning(models.Vote.post_id, models.Vote.user_id)
+        )
+        deleted = set(map(tuple, result.all()))
+
+    deltas = Counter(post_id for post_id, _ in added)
+    deltas.subtract(post_id for post_id, _ in deleted)
+    deltas = sorted((post_id, delta) for post_id, delta in deltas.items() if delta)
+    if deltas:
+        changes = values(column("post_id", Integer), column("delta", Integer), name="changes").data(deltas)
+        await db.execute(
+            update(models.Posts)
+            .where(models.Posts.id == changes.c.post_id)
+            .values(vote_count=models.Posts.vote_count + changes.c.delta, votes_changed_at=func.now())
+        )
+
+    return added, deleted
+
+
+# only used when settings.vote_write_behind is on, started from main.lifespan
+vote_buffer = VoteBuffer(apply_votes,
+                         max_pending=settings.vote_buffer_max_pending,
+                         flush_size=settings.vote_buffer_flush_size,
+                         flush_interval=settings.vote_buffer_flush_interval)
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED,
+             dependencies=[limit_by_user("write", settings.rate_limit_write_user)])
+@query_budget(3)  # user, vote + counter in one statement, existence check when it changed nothing
+async def create_vote(vote: schemas.Vote, response: Response, db: AsyncSession = Depends(get_async_db), current_user=Depends(oauth2.get_current_user)):
     
-    vote_query = db.query(models.Vote).filter(models.Vote.post_id == vote.post_id,
-                                              models.Vote.user_id == current_user.user_id)
-    found_vote = vote_query.first()
-    if vote.dir == 1:
-        if found_vote:
+    if settings.vote_write_behind:
+        # acknowledged now, written by the buffer's next flush
+        await vote_buffer.add(vote.post_id, current_user.id, vote.dir)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"message": "Vote accepted"}
+
+    if not await vote_and_count(db, vote.post_id, current_user.id, vote.dir):
+        if await db.scalar(select(models.Posts.id).where(models.Posts.id == vote.post_id)) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"Post with id {vote.post_id} not found")
+        if vote.dir == 1:
             raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                                 detail="Vote already exists")
-        new_vote = models.Vote(post_id=vote.post_id, user_id=current_user.user_id)
-        db.add(new_vote)
-        db.commit()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Vote not found")
+
+    await db.commit()
+    await cache.post_cache.invalidate_tags(f"post:{vote.post_id}")
+    vote_hub.hub.publish(vote.post_id)
+    if vote.dir == 1:
         return {"message": "Vote added successfully"}
-    else:
-        if not found_vote:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                detail="Vote not found")
-        vote_query.delete(synchronize_session=False)
-        db.commit()
-        return {"message": "Vote deleted successfully"}
-    
\ No newline at end of file
+    return {"message": "Vote deleted successfully"}
+
+
+@router.post("/batch", response_model=list[schemas.VoteResult],
+             dependencies=[limit_by_user("write", settings.rate_limit_write_user)])
+@query_budget(5)  # user, INSERT, DELETE, counter UPDATE, leftover existence check
+async def create_votes(votes: list[schemas.Vote], db: AsyncSession = Depends(get_async_db), current_user=Depends(oauth2.get_current_user)):
+
+    if len(votes) > settings.vote_batch_max_size:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"A batch can hold at most {settings.vote_batch_max_size} votes")
+    if len({vote.post_id for vote in votes}) != len(votes):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Each post can only appear once in a batch")
+
+    ups = [(vote.post_id, current_user.id) for vote in votes if vote.dir == 1]
+    downs = [(vote.post_id, current_user.id) for vote in votes if vote.dir != 1]
+    added, deleted = await apply_votes(db, ups, downs)
+
+    # only when something wasn't applied do we need to know which posts exist
+    leftover = [vote.post_id for vote in votes
+                if (vote.post_id, current_user.id) not in added | deleted]
+    existing = set()
+    if leftover:
+        existing = set((await db.execute(select(models.Posts.id).where(models.Posts.id.in_(leftover)))).scalars())
+    await db.commit()
+
+    changed = {post_id for post_id, _ in added | deleted}
+    if changed:
+        await cache.post_cache.invalidate_tags(*(f"post:{post_id}" for post_id in changed))
+        vote_hub.hub.publish(*changed)
+
+    results = []
+    for vote in votes:
+        if vote.post_id in changed:
+            code, detail = (status.HTTP_201_CREATED, "Vote added successfully") if vote.dir == 1 \
+                else (status.HTTP_200_OK, "Vote deleted successfully")
+        elif vote.post_id not in existing:
+            code, detail = status.HTTP_404_NOT_FOUND, f"Post with id {vote.post_id} not found"
+        elif vote.dir == 1:
+            code, detail = status.HTTP_409_CONFLICT, "Vote already exists"
+        else:
+            code, detail = status.HTTP_404_NOT_FOUND, "Vote not found"
+        results.append(schemas.VoteResult(post_id=vote.post_id, dir=vote.dir, status_code=code, detail=detail))
+    return results
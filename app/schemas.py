@@ -62,6 +62,49 @@ class PostResponse(PostParams):
     class Config:
         from_attributes = True
 
+def owner_response(owner) -> dict:
+    return {"id": owner.id, "created_at": owner.created_at, "email": owner.email}
+
+
+# what each name in ?fields= reads off a Posts row, in response order.
+# excerpt is the start of content cut in SQL (Posts.excerpt, only loaded when asked for)
+POST_FIELDS = {
+    "title": lambda post: post.title,
+    "content": lambda post: post.content,
+    "excerpt": lambda post: post.excerpt,
+    "published": lambda post: post.published,
+    "contact": lambda post: post.contact,
+    "created_at": lambda post: post.created_at,
+    "owner_id": lambda post: post.owner_id,
+    "owner": lambda post: owner_response(post.owner),
+    "votes": lambda post: post.vote_count,
+}
+
+
+def post_response(post, fields: Optional[tuple[str, ...]] = None) -> dict:
+    """PostResponse shaped dict built straight from a loaded Posts row (owner
+    included). The hot read paths use this instead of model_validate, the
+    data already came out of the database so there is nothing to validate.
+
+    With fields (names from POST_FIELDS) only those keys are in the dict."""
+    if fields is not None:
+        return {name: POST_FIELDS[name](post) for name in fields}
+    return {
+        "title": post.title,
+        "content": post.content,
+        "published": post.published,
+        "contact": post.contact,
+        "created_at": post.created_at,
+        "owner_id": post.owner_id,
+        "owner": owner_response(post.owner),
+        "votes": post.vote_count,
+    }
+
+class PostPage(BaseModel):
+    data: list[PostResponse]
+    next_cursor: Optional[str] = None
+
+
 class PostOutput(PostParams):
     Post: PostResponse
     votes: int
@@ -83,4 +126,16 @@ class TokenData(BaseModel):
 
 class Vote(BaseModel):
     post_id: int
-    dir: conint(le=1) # type: ignore
\ No newline at end of file
+    dir: conint(le=1) # type: ignore
+
+
+class Follow(BaseModel):
+    user_id: int
+    dir: conint(le=1) # type: ignore
+
+
+class VoteResult(BaseModel):
+    post_id: int
+    dir: int
+    status_code: int
+    detail: str
\ No newline at end of file
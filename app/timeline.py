@@ -0,0 +1,160 @@
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import delete, literal, select, true, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import metrics, models
+from .config import settings
+from .database import AsyncSession_local
+
+# Home timelines are precomputed: when someone posts, the post id is written
+# into the timelines table of every follower (fan-out on write), so reading a
+# feed is one range scan on (user_id, created_at, post_id) no matter how many
+# posts exist. Timelines are capped at timeline_max_length entries.
+#
+# Authors with fanout_max_followers or more followers would make one post cost
+# that many inserts, so they're skipped here and feed_query() pulls their
+# recent posts in at read time instead (fan-out on read).
+#
+# fan_out doesn't trim: trimming walks timeline_max_length index entries per
+# recipient, too much to do on every post. The timelines it grew are noted in
+# _untrimmed and trim_pending() cuts them back every timeline_trim_interval
+# seconds. In between a timeline can run a little past the cap, feed_query
+# only reads the newest entries so nobody notices.
+
+# user ids whose timeline got entries since the last trim_pending(), per
+# worker. Lost on restart, those timelines get trimmed after their next post.
+_untrimmed: set[int] = set()
+
+
+async def trim(db: AsyncSession, user_ids):
+    """Drop everything past the newest timeline_max_length entries of each
+    user in user_ids (a select of one column)"""
+    users = user_ids.subquery("users")
+    T = models.TimelineEntry
+    # the first entry that falls off the end, found by walking the index
+    cut = (
+        select(T.created_at, T.post_id)
+        .where(T.user_id == users.c[0])
+        .order_by(T.created_at.desc(), T.post_id.desc())
+        .offset(settings.timeline_max_length)
+        .limit(1)
+        .lateral("cut")
+    )
+    cutoffs = (
+        select(users.c[0].label("user_id"), cut.c.created_at, cut.c.post_id)
+        .select_from(users.join(cut, true()))
+        .subquery("cutoffs")
+    )
+    await db.execute(
+        delete(T).where(
+            T.user_id == cutoffs.c.user_id,
+            tuple_(T.created_at, T.post_id) <= tuple_(cutoffs.c.created_at, cutoffs.c.post_id),
+        )
+    )
+
+
+async def fan_out(post_id: int, author_id: int, created_at: datetime):
+    """Push a new post into the author's and their followers' timelines.
+
+    Runs as a background task after create_post has answered, in its own
+    session, and isn't counted against the request's SQL budget."""
+    with metrics.untracked():
+        async with AsyncSession_local() as db:
+            follower_count = await db.scalar(
+                select(models.User.follower_count).where(models.User.id == author_id))
+            if follower_count is None:
+                return
+            recipients = select(literal(author_id).label("user_id"))
+            if follower_count < settings.fanout_max_followers:
+                recipients = recipients.union_all(
+                    select(models.Follow.follower_id).where(models.Follow.followee_id == author_id))
+            rows = recipients.subquery("recipients")
+            result = await db.execute(
+                insert(models.TimelineEntry)
+                .from_select(["user_id", "post_id", "created_at"],
+                             select(rows.c.user_id, literal(post_id), literal(created_at)))
+                .on_conflict_do_nothing()
+                .returning(models.TimelineEntry.user_id)
+            )
+            grown = result.scalars().all()
+            await db.commit()
+        _untrimmed.update(grown)
+
+
+async def trim_pending():
+    """Trim the timelines fan_out grew since the last run, a batch of users
+    per transaction. Run by a PeriodicTask from main.lifespan."""
+    batch_size = settings.timeline_trim_batch_size
+    while _untrimmed:
+        batch = [_untrimmed.pop() for _ in range(min(batch_size, len(_untrimmed)))]
+        try:
+            async with AsyncSession_local() as db:
+                await trim(db, select(models.User.id).where(models.User.id.in_(batch)))
+                await db.commit()
+        except Exception:
+            _untrimmed.update(batch)
+            raise
+        # let requests have the connection between batches
+        await asyncio.sleep(0)
+
+
+async def backfill(db: AsyncSession, user_id: int, followee_id: int):
+    """Copy the newest posts of someone just followed into the timeline, the
+    caller commits"""
+    P = models.Posts
+    recent = (
+        select(literal(user_id), P.id, P.created_at)
+        .where(P.owner_id == followee_id)
+        .order_by(P.created_at.desc(), P.id.desc())
+        .limit(settings.timeline_max_length)
+    )
+    await db.execute(
+        insert(models.TimelineEntry)
+        .from_select(["user_id", "post_id", "created_at"], recent)
+        .on_conflict_do_nothing()
+    )
+    await trim(db, select(literal(user_id)))
+
+
+async def remove_author(db: AsyncSession, user_id: int, followee_id: int):
+    """Take an unfollowed author's posts back out of the timeline"""
+    T = models.TimelineEntry
+    await db.execute(
+        delete(T).where(T.user_id == user_id, T.post_id == models.Posts.id,
+                        models.Posts.owner_id == followee_id)
+    )
+
+
+def feed_query(user_id: int, limit: int, after: Optional[tuple[datetime, int]] = None):
+    """Posts for one page of user_id's feed, newest first.
+
+    Merges the precomputed timeline with the latest posts of followed
+    accounts that are too big to fan out. UNION drops posts found both ways
+    (an author who crossed the threshold keeps their old timeline entries)."""
+    T, P, F, U = models.TimelineEntry, models.Posts, models.Follow, models.User
+
+    pushed = select(T.post_id, T.created_at).where(T.user_id == user_id)
+    big_accounts = (
+        select(F.followee_id)
+        .join(U, U.id == F.followee_id)
+        .where(F.follower_id == user_id, U.follower_count >= settings.fanout_max_followers)
+    )
+    pulled = select(P.id.label("post_id"), P.created_at).where(P.owner_id.in_(big_accounts))
+    if after:
+        pushed = pushed.where(tuple_(T.created_at, T.post_id) < tuple_(*after))
+        pulled = pulled.where(tuple_(P.created_at, P.id) < tuple_(*after))
+    pushed = pushed.order_by(T.created_at.desc(), T.post_id.desc()).limit(limit)
+    pulled = pulled.order_by(P.created_at.desc(), P.id.desc()).limit(limit)
+
+    entries = pushed.union(pulled).subquery("entries")
+    return (
+        select(P)
+        .options(models.load_owner())
+        .join(entries, entries.c.post_id == P.id)
+        .order_by(entries.c.created_at.desc(), entries.c.post_id.desc())
+        .limit(limit)
+    )
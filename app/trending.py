@@ -0,0 +1,60 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from . import models
+from .config import settings
+from .database import AsyncSession_local
+
+logger = logging.getLogger(__name__)
+
+# Reddit style "hot" score: log10 of the votes plus the post's age in units of
+# trending_decay_seconds. Every decay period a post needs 10x the votes to keep
+# its place, so old posts sink on their own, but the score of one post only
+# changes when its votes change. That's what lets refresh_scores() touch just
+# the posts voted on since the last run.
+HOT_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+# overlap between runs, covers transactions that stamped votes_changed_at
+# before the last run started but committed after it
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+# any constant works, it only has to be the same in every worker
+REFRESH_LOCK_ID = 7_017_001
+
+_last_refresh: Optional[datetime] = None
+
+
+def hot_score(vote_count, created_at):
+    age = func.extract("epoch", created_at) - HOT_EPOCH.timestamp()
+    return func.log(func.greatest(vote_count, 1)) + age / settings.trending_decay_seconds
+
+
+async def refresh_scores():
+    """Recompute post_scores for posts whose votes changed since the last run
+    (all of them the first time a worker runs it with an empty table)"""
+    global _last_refresh
+    P, S = models.Posts, models.PostScore
+    async with AsyncSession_local() as db:
+        # one worker at a time, the others just skip this round
+        if not await db.scalar(select(func.pg_try_advisory_xact_lock(REFRESH_LOCK_ID))):
+            return
+        started = await db.scalar(select(func.now()))
+        since = _last_refresh
+        if since is None:
+            since = await db.scalar(select(func.max(S.updated_at)))
+
+        query = select(P.id, hot_score(P.vote_count, P.created_at), func.now())
+        if since is not None:
+            query = query.where(P.votes_changed_at >= since - REFRESH_OVERLAP)
+        stmt = insert(S).from_select(["post_id", "score", "updated_at"], query)
+        result = await db.execute(stmt.on_conflict_do_update(
+            index_elements=[S.post_id],
+            set_={"score": stmt.excluded.score, "updated_at": stmt.excluded.updated_at},
+        ))
+        await db.commit()
+        _last_refresh = started
+        logger.debug("Refreshed %d post scores", result.rowcount)
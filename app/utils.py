@@ -1,10 +1,107 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
+from .config import settings
 
-pwd_context = CryptContext(schemes = ["bcrypt"], deprecated = "auto")
+pwd_context = CryptContext(schemes = ["bcrypt"], deprecated = "auto", bcrypt__rounds = settings.bcrypt_rounds)
 
 def hash(password: str):
     return pwd_context.hash(password)
 
 
 def verify(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def verify_and_update(plain_password: str, hashed_password: str):
+    """Returns (matches, new_hash), new_hash is set when the stored hash uses
+    an outdated cost and should be replaced"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+# bcrypt runs in its own small process pool, so a burst of logins can't eat
+# the threadpool (or the GIL) that every other endpoint depends on
+_hash_pool: Optional[ProcessPoolExecutor] = None
+# jobs submitted and not finished yet, the done callbacks run on the pool's
+# own thread hence the lock
+_hash_jobs = 0
+_hash_jobs_lock = threading.Lock()
+
+
+def get_hash_pool() -> ProcessPoolExecutor:
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = ProcessPoolExecutor(max_workers=settings.hash_pool_workers,
+                                         mp_context=multiprocessing.get_context("spawn"))
+    return _hash_pool
+
+
+def shutdown_hash_pool():
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=False, cancel_futures=True)
+        _hash_pool = None
+
+
+def _drop_broken_pool(pool: ProcessPoolExecutor):
+    # a worker died (OOM killer, ...) and took the pool down with it, every
+    # later job would fail too. The next call starts a fresh one.
+    global _hash_pool
+    if _hash_pool is pool:
+        _hash_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _job_done(future):
+    global _hash_jobs
+    with _hash_jobs_lock:
+        _hash_jobs -= 1
+
+
+async def run_in_hash_pool(fn, *args):
+    """Run fn in the hashing pool, failing fast with a 503 once the pool is
+    backed up instead of letting requests queue until the client gives up.
+
+    A job holds its slot until the pool is done with it, not until the
+    request gives up on it: a timed out hash that is still running (or
+    queued) keeps counting."""
+    global _hash_jobs
+    busy = HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail="Server is busy, try again shortly",
+                         headers={"Retry-After": "1"})
+    with _hash_jobs_lock:
+        if _hash_jobs >= settings.hash_pool_workers + settings.hash_pool_max_queue:
+            raise busy
+        _hash_jobs += 1
+
+    pool = get_hash_pool()
+    try:
+        future = pool.submit(fn, *args)
+    except BrokenProcessPool:
+        _job_done(None)
+        _drop_broken_pool(pool)
+        raise busy
+    future.add_done_callback(_job_done)
+    try:
+        # on timeout a job that hasn't started yet is cancelled, a running
+        # one can't be and finishes in the pool
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=settings.hash_timeout_seconds)
+    except asyncio.TimeoutError:
+        raise busy
+    except BrokenProcessPool:
+        _drop_broken_pool(pool)
+        raise busy
+
+
+async def hash_password(password: str):
+    return await run_in_hash_pool(hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str):
+    return await run_in_hash_pool(verify_and_update, plain_password, hashed_password)
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import Awaitable, Callable, Iterable, Optional
+
+from . import cache, vote_hub
+from .database import AsyncSession_local
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBuffer:
+    """Write-behind buffer for votes, one per worker process.
+
+    Votes are kept as the latest intent per (post_id, user_id), so voting up
+    then down before a flush nets out, and written in bulk by `apply` (see
+    routers.vote.apply_votes) once flush_size votes are waiting or every
+    flush_interval seconds, whichever comes first.
+
+    Reads only see buffered votes through flush(post_ids), which the post
+    routes call first, and that only reaches this worker's buffer. With more
+    than one worker a read served by another worker misses the votes held
+    here until the next flush, up to flush_interval seconds later. After that
+    the voter reads from the primary (replicas.ReadYourWritesMiddleware), so
+    replica lag doesn't add to it."""
+
+    def __init__(self, apply: Callable[..., Awaitable], max_pending: int, flush_size: int, flush_interval: float):
+        self.apply = apply
+        self.max_pending = max_pending
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending: dict[tuple[int, int], int] = {}
+        # post_id -> number of pending keys, so reads can check cheaply
+        self._pending_posts: Counter = Counter()
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def add(self, post_id: int, user_id: int, dir: int):
+        key = (post_id, user_id)
+        if key not in self._pending and len(self._pending) >= self.max_pending:
+            # memory is bounded: make the caller wait for a flush instead of growing
+            await self.flush()
+        if key not in self._pending:
+            self._pending_posts[post_id] += 1
+        self._pending[key] = dir
+        if len(self._pending) >= self.flush_size:
+            self._wakeup.set()
+
+    def has_pending(self, post_ids: Iterable[int]) -> bool:
+        return any(post_id in self._pending_posts for post_id in post_ids)
+
+    async def flush(self, post_ids: Optional[Iterable[int]] = None):
+        """Write pending votes (only those for post_ids, if given) to the database"""
+        async with self._flush_lock:
+            if post_ids is None:
+                batch, self._pending = self._pending, {}
+                self._pending_posts.clear()
+            else:
+                post_ids = set(post_ids) & self._pending_posts.keys()
+                batch = {key: dir for key, dir in self._pending.items() if key[0] in post_ids}
+                for key in batch:
+                    del self._pending[key]
+                for post_id in post_ids:
+                    del self._pending_posts[post_id]
+            if not batch:
+                return
+
+            ups = [key for key, dir in batch.items() if dir == 1]
+            downs = [key for key, dir in batch.items() if dir != 1]
+            try:
+                async with AsyncSession_local() as db:
+                    added, deleted = await self.apply(db, ups, downs)
+                    await db.commit()
+            except Exception:
+                # put them back unless a newer vote for the same key came in meanwhile
+                for key, dir in batch.items():
+                    if key not in self._pending:
+                        self._pending[key] = dir
+                        self._pending_posts[key[0]] += 1
+                raise
+
+            changed = {post_id for post_id, _ in added | deleted}
+            if changed:
+                await cache.post_cache.invalidate_tags(*(f"post:{post_id}" for post_id in changed))
+                vote_hub.hub.publish(*changed)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Flushing %d buffered votes failed, will retry", len(self._pending))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background flusher and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
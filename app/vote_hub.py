@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from typing import Optional
+
+import asyncpg
+from sqlalchemy import select
+
+from . import metrics, models
+from .config import settings
+from .database import AsyncSession_local, url
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "post_votes"
+# postgres caps a NOTIFY payload just under 8000 bytes
+NOTIFY_MAX_PAYLOAD = 7000
+
+
+class SubscriberDropped(Exception):
+    pass
+
+
+class Subscription:
+    """Vote counts of one post for one client, fed by the hub. A client that
+    falls live_queue_size updates behind is dropped, it reconnects and starts
+    again from a fresh count."""
+
+    def __init__(self, post_id: int):
+        self.post_id = post_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.live_queue_size)
+        self.dropped = False
+
+    def push(self, update: dict) -> bool:
+        try:
+            self.queue.put_nowait(update)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def drop(self):
+        self.dropped = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)  # wakes up next()
+
+    async def next(self, timeout: float) -> Optional[dict]:
+        """The next update, None if there was none for timeout seconds (time
+        for a heartbeat). Raises SubscriberDropped once dropped."""
+        try:
+            update = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        if update is None or self.dropped:
+            raise SubscriberDropped
+        return update
+
+
+class VoteHub:
+    """In-process pub/sub for vote counts, one per worker.
+
+    publish() only marks a post as changed, tick() (every live_interval
+    seconds, from main.lifespan) reads the current counts of all changed
+    posts that someone is watching in one SELECT and pushes them. So a post
+    gets at most one update per interval however many votes it gets, and
+    what's pushed is always a committed count.
+
+    With live_notify the changed post ids go through postgres NOTIFY instead,
+    every worker LISTENs and pushes to its own subscribers."""
+
+    def __init__(self):
+        self._subscribers: dict[int, set[Subscription]] = {}
+        self._changed: set[int] = set()
+        # changed on this worker, still to be NOTIFYed
+        self._outgoing: set[int] = set()
+        self._listener = None
+
+    def subscriber_count(self) -> int:
+        return sum(map(len, self._subscribers.values()))
+
+    def stats(self) -> dict:
+        return {"subscribers": self.subscriber_count(), "posts": len(self._subscribers),
+                "notify": self._listener is not None and not self._listener.is_closed()}
+
+    def subscribe(self, post_id: int) -> Optional[Subscription]:
+        """None when this worker already has live_max_subscribers"""
+        if self.subscriber_count() >= settings.live_max_subscribers:
+            return None
+        subscription = Subscription(post_id)
+        self._subscribers.setdefault(post_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.post_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.post_id]
+
+    def publish(self, *post_ids: int):
+        """Call after committing vote changes for post_ids"""
+        if settings.live_notify:
+            self._outgoing.update(post_ids)
+        else:
+            self._changed.update(post_id for post_id in post_ids if post_id in self._subscribers)
+
+    async def tick(self):
+        if settings.live_notify:
+            # reconnects if the listening connection went away
+            await self._ensure_listener()
+            if self._outgoing:
+                await self._notify()
+        changed = self._changed & self._subscribers.keys()
+        self._changed = set()
+        if not changed:
+            return
+        with metrics.untracked():
+            async with AsyncSession_local() as db:
+                counts = (await db.execute(
+                    select(models.Posts.id, models.Posts.vote_count).where(models.Posts.id.in_(changed))
+                )).all()
+        for post_id, votes in counts:
+            update = {"post_id": post_id, "votes": votes}
+            for subscription in list(self._subscribers.get(post_id, ())):
+                if not subscription.push(update):
+                    logger.info("Dropping a slow live subscriber of post %s", post_id)
+                    self.unsubscribe(subscription)
+                    subscription.drop()
+
+    async def _notify(self):
+        post_ids, self._outgoing = sorted(self._outgoing), set()
+        payloads, current = [], []
+        for post_id in post_ids:
+            if current and len(",".join(map(str, current + [post_id]))) > NOTIFY_MAX_PAYLOAD:
+                payloads.append(",".join(map(str, current)))
+                current = []
+            current.append(post_id)
+        payloads.append(",".join(map(str, current)))
+        try:
+            for payload in payloads:
+                await self._listener.execute("SELECT pg_notify($1, $2)", NOTIFY_CHANNEL, payload)
+        except Exception:
+            # the next tick tries again
+            self._outgoing.update(post_ids)
+            raise
+
+    def _on_notify(self, connection, pid, channel, payload):
+        post_ids = map(int, payload.split(","))
+        self._changed.update(post_id for post_id in post_ids if post_id in self._subscribers)
+
+    async def _ensure_listener(self):
+        if self._listener is not None and not self._listener.is_closed():
+            return
+        # its own connection outside the pool, it stays checked out for good
+        self._listener = await asyncpg.connect(url.set(drivername="postgresql").render_as_string(hide_password=False))
+        await self._listener.add_listener(NOTIFY_CHANNEL, self._on_notify)
+
+    async def start(self):
+        if settings.live_notify:
+            await self._ensure_listener()
+
+    async def stop(self):
+        for subscribers in self._subscribers.values():
+            for subscription in subscribers:
+                subscription.drop()
+        self._subscribers.clear()
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+
+
+hub = VoteHub()
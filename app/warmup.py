@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import time
+
+from jose import jwt
+from sqlalchemy import text
+
+from . import oauth2, utils
+from .config import settings
+from .database import async_engine
+
+logger = logging.getLogger(__name__)
+
+
+async def prefill_pool(engine, count: int):
+    """Open count connections at once and give them back, so the first
+    requests find them idle in the pool instead of paying for the connect"""
+    conns = [engine.connect() for _ in range(count)]
+    try:
+        await asyncio.gather(*(conn.start() for conn in conns))
+        await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in conns))
+    finally:
+        await asyncio.gather(*(conn.close() for conn in conns), return_exceptions=True)
+
+
+async def prime_hashing():
+    """Start every hashing worker (spawning one means a fresh interpreter that
+    imports passlib + bcrypt) with a cheap verify"""
+    dummy = utils.pwd_context.hash("warm-up", rounds=4)
+    await asyncio.gather(*(utils.run_in_hash_pool(utils.verify, "warm-up", dummy)
+                           for _ in range(settings.hash_pool_workers)))
+
+
+def prime_jwt():
+    """jose picks and imports its crypto backend on first use"""
+    token = oauth2.create_access_token(data={"user_id": 0})
+    jwt.decode(token, oauth2.SECRET_KEY, algorithms=[oauth2.ALGORITHM])
+
+
+async def warm_up() -> dict:
+    """Optional startup stage (settings.warmup_on_startup), returns how long
+    each step took in ms"""
+    timings = {}
+
+    async def timed(name, coro):
+        start = time.perf_counter()
+        await coro
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    start = time.perf_counter()
+    prime_jwt()
+    timings["jwt"] = round((time.perf_counter() - start) * 1000, 1)
+    await asyncio.gather(timed("pool", prefill_pool(async_engine, settings.db_pool_size)),
+                         timed("hashing", prime_hashing()))
+    logger.info("Warm-up done: %s", ", ".join(f"{name} {ms} ms" for name, ms in timings.items()))
+    return timings
@@ -0,0 +1,84 @@
+"""Load test for the API hot paths.
+
+Runs app.main:app in-process (no network, no uvicorn) against the database
+configured in .env, seeds it with a reproducible dataset and drives a fixed
+mix of requests at fixed concurrency. Prints JSON with throughput and
+p50/p95/p99 latency plus SQL statements per request for every route, so two
+commits can be compared with a plain diff.
+
+    python -m benchmarks --posts 100000 --concurrency 32 --output before.json
+
+Seeding writes to the configured database, point it at a scratch one. The
+app uses postgres-only SQL (tsvector, ON CONFLICT, asyncpg) so there is no
+SQLite mode.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+
+from .runner import ROUTES, run
+from .seed import seed
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        op, _, weight = part.partition("=")
+        if op not in ROUTES:
+            raise argparse.ArgumentTypeError(f"unknown operation {op!r}, pick from {', '.join(ROUTES)}")
+        mix[op] = int(weight or 1)
+    return mix
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--votes-per-post", type=int, default=3)
+    parser.add_argument("--no-reset", dest="reset", action="store_false",
+                        help="keep existing rows instead of truncating the tables first")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("login=2,list=40,get=35,vote=15,create=8"))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    user_ids, post_ids = seed(args.users, args.posts, args.votes_per_post, args.reset)
+
+    from app.config import settings
+    from app.main import app
+    # every simulated client comes from the same address, the limiter would
+    # just turn the run into a 429 benchmark
+    settings.rate_limit_enabled = False
+    results = asyncio.run(run(app, args.mix, args.requests, args.concurrency, args.warmup,
+                              len(user_ids), post_ids, args.seed))
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {"users": args.users, "posts": args.posts, "votes_per_post": args.votes_per_post,
+                   "requests": args.requests, "warmup": args.warmup, "concurrency": args.concurrency,
+                   "mix": args.mix, "seed": args.seed},
+        **results,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
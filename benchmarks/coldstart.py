@@ -0,0 +1,112 @@
+"""Cold start of one worker, from `import app.main` to the first answered
+requests.
+
+Every run is a fresh interpreter (that's what a new worker or a serverless
+instance is), measuring the import, the lifespan startup and the first
+GET /posts/ and POST /login, with and without the warm-up stage. Also lists
+the slowest packages from `python -X importtime`.
+
+    python -m benchmarks.coldstart --runs 5
+
+Needs the database from .env with the schema migrated; it logs in as the
+first seeded benchmark user, so run `python -m benchmarks` once before.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+def child():
+    """One cold start, prints its timings as JSON"""
+    import time
+
+    start = time.perf_counter()
+    from app.main import app
+    timings = {"import": time.perf_counter() - start}
+
+    import asyncio
+    import httpx
+
+    from app.config import settings
+    from .seed import BENCH_PASSWORD, bench_email
+
+    settings.rate_limit_enabled = False
+
+    async def run():
+        start = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            timings["startup"] = time.perf_counter() - start
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for name, request in (
+                    ("first_list", lambda: client.get("/posts/")),
+                    ("first_login", lambda: client.post("/login", data={"username": bench_email(0),
+                                                                        "password": BENCH_PASSWORD})),
+                ):
+                    start = time.perf_counter()
+                    response = await request()
+                    timings[name] = time.perf_counter() - start
+                    assert response.status_code == 200, (name, response.status_code, response.text)
+
+    asyncio.run(run())
+    print(json.dumps({name: round(seconds * 1000, 1) for name, seconds in timings.items()}))
+
+
+def spawn(warmup: bool) -> dict:
+    env = {**os.environ, "WARMUP_ON_STARTUP": "1" if warmup else "0"}
+    out = subprocess.run([sys.executable, "-m", "benchmarks.coldstart", "--child"], env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list[dict]:
+    """Import time per package pulled in by app.main, cumulative (a package
+    counts what it imports from other packages too)"""
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                         capture_output=True, text=True, check=True).stderr
+    lines = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        lines.append((depth, name.strip().split(".")[0], int(cumulative)))
+    # the output lists children before their parent, walk it backwards to know
+    # each import's parent and count only where a package is entered
+    totals, stack = {}, []
+    for depth, package, cumulative in reversed(lines):
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        if not stack or stack[-1][1] != package:
+            totals[package] = totals.get(package, 0) + cumulative
+        stack.append((depth, package))
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{"package": name, "ms": round(us / 1000, 1)} for name, us in ranked]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.coldstart", description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    report = {"runs": args.runs, "slowest_imports": slowest_imports(args.top)}
+    for warmup in (False, True):
+        runs = [spawn(warmup) for _ in range(args.runs)]
+        report["warmup" if warmup else "no_warmup"] = {
+            name: {"median_ms": round(statistics.median(run[name] for run in runs), 1),
+                   "max_ms": max(run[name] for run in runs)}
+            for name in runs[0]
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""CPU cost and ratio of every response compression codec.
+
+Compresses a rendered GET /posts/ page in one go (what etag_response and
+CompressionMiddleware do for whole bodies) and an NDJSON export chunk by
+chunk (what the middleware does for StreamingResponse bodies), with the
+levels from settings. Prints JSON with the compressed size, ratio and CPU
+nanoseconds per input byte for each codec.
+
+    python -m benchmarks.compression --posts 100 --rounds 50
+
+br and zstd are only measured when brotli / zstandard are installed. No
+database needed, the rows are built in memory.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from app import compression, metrics, models, schemas
+
+WORDS = ("the a post about fastapi postgres query index cache vote feed user timeline latency "
+         "python async request response page cursor replica token write read server client "
+         "today really think just some more than with from that this have will").split()
+
+
+def make_posts(count: int, seed: int) -> list[models.Posts]:
+    """Posts with varied text, lorem ipsum repeated would flatter every codec"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    owners = [models.User(id=i, email=f"user{i}@example.com", password="x", created_at=now - timedelta(days=i))
+              for i in range(20)]
+    posts = []
+    for i in range(count):
+        owner = rng.choice(owners)
+        posts.append(models.Posts(
+            id=i, title=" ".join(rng.choices(WORDS, k=rng.randint(3, 9))),
+            content=" ".join(rng.choices(WORDS, k=rng.randint(20, 120))),
+            published=True, contact=None, created_at=now - timedelta(seconds=rng.randint(0, 10 ** 6)),
+            owner_id=owner.id, owner=owner, vote_count=rng.randint(0, 500)))
+    return posts
+
+
+def cpu_ns(fn, rounds: int) -> float:
+    fn()  # warm up
+    samples = []
+    for _ in range(rounds):
+        start = time.process_time_ns()
+        fn()
+        samples.append(time.process_time_ns() - start)
+    return statistics.median(samples)
+
+
+def stream_all(codec: compression.Codec, chunks: list[bytes]) -> bytes:
+    stream = codec.stream()
+    return b"".join(stream.compress(chunk) for chunk in chunks) + stream.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compression", description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=100, help="posts on the page")
+    parser.add_argument("--export-posts", type=int, default=5000)
+    parser.add_argument("--chunk-rows", type=int, default=500, help="rows per streamed chunk")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    page = metrics.dumps({"data": [schemas.post_response(post) for post in make_posts(args.posts, args.seed)],
+                          "next_cursor": None})
+    rows = [metrics.dumps(schemas.post_response(post)) + b"\n" for post in make_posts(args.export_posts, args.seed)]
+    chunks = [b"".join(rows[i:i + args.chunk_rows]) for i in range(0, len(rows), args.chunk_rows)]
+    export_size = sum(map(len, chunks))
+
+    report = {"page_bytes": len(page), "export_bytes": export_size, "export_chunks": len(chunks),
+              "rounds": args.rounds, "codecs": {}}
+    for name, codec in compression.codecs.items():
+        page_ns = cpu_ns(lambda: codec.compress(page), args.rounds)
+        export_ns = cpu_ns(lambda: stream_all(codec, chunks), max(1, args.rounds // 10))
+        compressed_page = len(codec.compress(page))
+        compressed_export = len(stream_all(codec, chunks))
+        report["codecs"][name] = {
+            "level": codec.level,
+            "page": {"bytes": compressed_page, "ratio": round(len(page) / compressed_page, 2),
+                     "cpu_ms": round(page_ns / 1e6, 3), "cpu_ns_per_byte": round(page_ns / len(page), 2)},
+            "export_streamed": {"bytes": compressed_export, "ratio": round(export_size / compressed_export, 2),
+                                "cpu_ms": round(export_ns / 1e6, 3),
+                                "cpu_ns_per_byte": round(export_ns / export_size, 2)},
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""SQL statements (round trips to postgres) and latency of the write routes.
+
+Runs every write route --repeat times in-process, on the happy path and on
+the error paths (someone else's post, a post that doesn't exist, a
+duplicate), and prints JSON with the statements per request and the median
+latency of each case. Check out an older commit and run it again to get the
+before numbers.
+
+    python -m benchmarks.roundtrips --repeat 50
+
+Creates users and posts in the configured database, point it at a scratch one.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import httpx
+from sqlalchemy import event, select
+
+from app import metrics, models
+from app.database import AsyncSession_local, async_engine
+from .runner import _statements
+
+PASSWORD = "roundtrips"
+
+
+def _count_statement(*args):
+    # metrics.untracked() clears current_timings for background work, like the
+    # timeline fan-out create_post leaves behind, which ASGITransport runs
+    # before handing back the response
+    counter = _statements.get()
+    if counter is not None and metrics.current_timings.get() is not None:
+        counter[0] += 1
+
+
+async def measure(call) -> tuple[int, float, int]:
+    counter = [0]
+    token = _statements.set(counter)
+    timings_token = metrics.current_timings.set(metrics.RequestTimings())
+    start = time.perf_counter()
+    response = await call()
+    elapsed = time.perf_counter() - start
+    metrics.current_timings.reset(timings_token)
+    _statements.reset(token)
+    return counter[0], elapsed, response.status_code
+
+
+async def run(app, repeat: int) -> dict:
+    from app.config import settings
+
+    settings.rate_limit_enabled = False
+    prefix = uuid.uuid4().hex[:8]
+    results = {}
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", _count_statement)
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+                async def case(name, calls):
+                    samples = [await measure(call) for call in calls]
+                    results[name] = {
+                        "status": sorted({code for _, _, code in samples}),
+                        "sql_per_request": round(statistics.mean(n for n, _, _ in samples), 2),
+                        "p50_ms": round(statistics.median(s for _, s, _ in samples) * 1000, 2),
+                    }
+
+                def signup(email):
+                    return lambda: client.post("/user/", json={"email": email, "password": PASSWORD})
+
+                owner, other = f"rt-{prefix}-owner@example.com", f"rt-{prefix}-other@example.com"
+                await case("signup", [signup(owner), signup(other)]
+                           + [signup(f"rt-{prefix}-{i}@example.com") for i in range(repeat - 2)])
+                await case("signup duplicate", [signup(owner) for _ in range(repeat)])
+
+                async def login(email):
+                    response = await client.post("/login", data={"username": email, "password": PASSWORD})
+                    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+                mine, theirs = await login(owner), await login(other)
+
+                await case("create post", [lambda: client.post("/posts/", json={"title": "roundtrips", "content": "x"},
+                                                               headers=mine)
+                                           for _ in range(repeat)])
+                # PostResponse has no id
+                async with AsyncSession_local() as db:
+                    post_ids = list(await db.scalars(
+                        select(models.Posts.id).join(models.User)
+                        .where(models.User.email == owner).order_by(models.Posts.id)))
+
+                missing = 2 ** 31 - 1
+                body = {"title": "updated", "content": "y"}
+                await case("update post", [lambda i=i: client.put(f"/posts/{i}", json=body, headers=mine)
+                                           for i in post_ids])
+                await case("update post not owner", [lambda i=i: client.put(f"/posts/{i}", json=body, headers=theirs)
+                                                     for i in post_ids])
+                await case("update post missing", [lambda: client.put(f"/posts/{missing}", json=body, headers=mine)
+                                                   for _ in range(repeat)])
+
+                def vote(post_id, dir):
+                    return lambda: client.post("/votes/", json={"post_id": post_id, "dir": dir}, headers=theirs)
+                await case("vote", [vote(i, 1) for i in post_ids])
+                await case("vote duplicate", [vote(i, 1) for i in post_ids])
+                await case("unvote", [vote(i, 0) for i in post_ids])
+                await case("unvote missing", [vote(i, 0) for i in post_ids])
+                await case("vote missing post", [vote(missing, 1) for _ in range(repeat)])
+
+                await case("delete post not owner", [lambda i=i: client.delete(f"/posts/{i}", headers=theirs)
+                                                     for i in post_ids])
+                await case("delete post", [lambda i=i: client.delete(f"/posts/{i}", headers=mine)
+                                           for i in post_ids])
+                await case("delete post missing", [lambda: client.delete(f"/posts/{missing}", headers=mine)
+                                                   for _ in range(repeat)])
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", _count_statement)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.roundtrips", description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    from app.main import app
+    print(json.dumps(asyncio.run(run(app, max(args.repeat, 2))), indent=2))
+
+
+if __name__ == "__main__":
+    main()
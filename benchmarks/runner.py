@@ -0,0 +1,152 @@
+import asyncio
+import contextvars
+import random
+import time
+from collections import defaultdict
+
+import httpx
+from sqlalchemy import event
+
+from app.database import async_engine
+from .seed import BENCH_PASSWORD, bench_email
+
+# statements executed on behalf of the request currently running in this task
+_statements = contextvars.ContextVar("bench_statements", default=None)
+
+
+def _count_statement(*args):
+    counter = _statements.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statements = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def record(self, route: str, seconds: float, statements: int, status_code: int):
+        self.latencies[route].append(seconds)
+        self.statements[route] += statements
+        if status_code >= 500:
+            self.errors[route] += 1
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        for route, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            routes[route] = {
+                "requests": len(values),
+                "errors": self.errors[route],
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(percentile(values, 50) * 1000, 3),
+                "p95_ms": round(percentile(values, 95) * 1000, 3),
+                "p99_ms": round(percentile(values, 99) * 1000, 3),
+                "sql_per_request": round(self.statements[route] / len(values), 3),
+            }
+        total = sum(len(values) for values in self.latencies.values())
+        return {"elapsed_seconds": round(elapsed, 3),
+                "throughput_rps": round(total / elapsed, 2),
+                "routes": routes}
+
+
+class Workload:
+    """Mixed traffic against the app, every worker draws from one seeded RNG"""
+
+    def __init__(self, client: httpx.AsyncClient, user_count: int, post_ids: list[int], seed: int):
+        self.client = client
+        self.user_count = user_count
+        self.post_ids = post_ids
+        self.rng = random.Random(seed)
+        self.tokens: dict[int, str] = {}
+        self.cursors: list[str] = []
+
+    async def login_all(self):
+        for i in range(self.user_count):
+            response = await self.client.post("/login", data={"username": bench_email(i), "password": BENCH_PASSWORD})
+            response.raise_for_status()
+            self.tokens[i] = response.json()["access_token"]
+
+    def auth(self):
+        user = self.rng.randrange(self.user_count)
+        return {"Authorization": f"Bearer {self.tokens[user]}"}
+
+    async def login(self):
+        user = self.rng.randrange(self.user_count)
+        return await self.client.post("/login", data={"username": bench_email(user), "password": BENCH_PASSWORD})
+
+    async def list_posts(self):
+        # mostly first pages, sometimes follow a cursor we've seen before
+        params = {}
+        if self.cursors and self.rng.random() < 0.3:
+            params["after"] = self.rng.choice(self.cursors)
+        response = await self.client.get("/posts/", params=params)
+        if response.status_code == 200:
+            cursor = response.json().get("next_cursor")
+            if cursor and len(self.cursors) < 1000:
+                self.cursors.append(cursor)
+        return response
+
+    async def get_post(self):
+        return await self.client.get(f"/posts/{self.rng.choice(self.post_ids)}")
+
+    async def vote(self):
+        body = {"post_id": self.rng.choice(self.post_ids), "dir": self.rng.choice((0, 1))}
+        return await self.client.post("/votes/", json=body, headers=self.auth())
+
+    async def create_post(self):
+        body = {"title": f"bench {self.rng.random()}", "content": "benchmark post " * 20}
+        return await self.client.post("/posts/", json=body, headers=self.auth())
+
+
+ROUTES = {
+    "login": ("POST /login", Workload.login),
+    "list": ("GET /posts/", Workload.list_posts),
+    "get": ("GET /posts/{id}", Workload.get_post),
+    "vote": ("POST /votes/", Workload.vote),
+    "create": ("POST /posts/", Workload.create_post),
+}
+
+
+async def run(app, mix: dict[str, int], requests: int, concurrency: int, warmup: int,
+              user_count: int, post_ids: list[int], seed: int) -> dict:
+    event.listen(async_engine.sync_engine, "before_cursor_execute", _count_statement)
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                workload = Workload(client, user_count, post_ids, seed)
+                await workload.login_all()
+
+                ops = list(mix)
+                weights = [mix[op] for op in ops]
+                plan = workload.rng.choices(ops, weights=weights, k=warmup + requests)
+                recorder = Recorder()
+                queue = iter(enumerate(plan))
+
+                async def worker():
+                    for i, op in queue:
+                        route, call = ROUTES[op]
+                        counter = [0]
+                        token = _statements.set(counter)
+                        start = time.perf_counter()
+                        response = await call(workload)
+                        elapsed = time.perf_counter() - start
+                        _statements.reset(token)
+                        if i >= warmup:
+                            recorder.record(route, elapsed, counter[0], response.status_code)
+
+                start = time.perf_counter()
+                await asyncio.gather(*(worker() for _ in range(concurrency)))
+                return recorder.report(time.perf_counter() - start)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", _count_statement)
@@ -0,0 +1,94 @@
+"""CPU cost of rendering one page of posts, old path vs fast path.
+
+The old path is what GET /posts/ used to do: PostResponse.model_validate for
+every row, wrap them in a PostPage, let FastAPI validate that again against
+response_model and run it through jsonable_encoder + json.dumps. The fast
+path builds plain dicts with schemas.post_response and hands them to orjson.
+
+    python -m benchmarks.serialization --posts 1000 --rounds 50
+
+No database needed, the rows are built in memory.
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from app import metrics, models, schemas
+
+
+def make_posts(count: int) -> list[models.Posts]:
+    now = datetime.now(timezone.utc)
+    owner = models.User(id=1, email="bench-owner@example.com", password="x", created_at=now)
+    return [
+        models.Posts(id=i, title=f"post {i}", content="lorem ipsum dolor sit amet " * 8,
+                     published=True, contact=None, created_at=now - timedelta(seconds=i),
+                     owner_id=owner.id, owner=owner, vote_count=i % 50)
+        for i in range(count)
+    ]
+
+
+_page_adapter = TypeAdapter(schemas.PostPage)
+
+
+def old_path(posts) -> bytes:
+    page = schemas.PostPage(
+        data=[schemas.PostResponse.model_validate(post, from_attributes=True) for post in posts],
+        next_cursor=None,
+    )
+    # what FastAPI does with a returned model: validate against response_model,
+    # dump it, jsonable_encoder, then the stdlib json encoder in JSONResponse
+    checked = _page_adapter.validate_python(page, from_attributes=True)
+    content = jsonable_encoder(_page_adapter.dump_python(checked, mode="json"))
+    return JSONResponse(content).body
+
+
+def fast_path(posts) -> bytes:
+    return metrics.dumps({"data": [schemas.post_response(post) for post in posts], "next_cursor": None})
+
+
+def measure(fn, posts, rounds: int) -> list[float]:
+    fn(posts)  # warm up
+    samples = []
+    for _ in range(rounds):
+        start = time.process_time()
+        fn(posts)
+        samples.append(time.process_time() - start)
+    return samples
+
+
+def summary(samples: list[float]) -> dict:
+    return {"median_ms": round(statistics.median(samples) * 1000, 3),
+            "min_ms": round(min(samples) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.serialization", description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    posts = make_posts(args.posts)
+    # both paths have to produce the same document
+    if json.loads(old_path(posts)) != json.loads(fast_path(posts)):
+        raise SystemExit("old and fast path disagree")
+
+    old = summary(measure(old_path, posts, args.rounds))
+    fast = summary(measure(fast_path, posts, args.rounds))
+    print(json.dumps({
+        "posts": args.posts,
+        "rounds": args.rounds,
+        "old": old,
+        "fast": fast,
+        "cpu_saved_ms_per_page": round(old["median_ms"] - fast["median_ms"], 3),
+        "speedup": round(old["median_ms"] / fast["median_ms"], 1) if fast["median_ms"] else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
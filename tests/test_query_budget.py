@@ -0,0 +1,110 @@
+"""Every @query_budget route run with SQL_BUDGET_MODE=raise, so a route that
+goes over its budget (an N+1 sneaking in) fails here instead of just getting
+slower.
+
+    python -m pytest tests
+
+Needs the database from .env with the schema migrated, it creates users and
+posts in it, point it at a scratch one. Skipped when the database is down.
+"""
+import os
+import uuid
+
+# read by app.config and app.main at import time
+os.environ["SQL_BUDGET_MODE"] = "raise"
+os.environ["RATE_LIMIT_ENABLED"] = "0"
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.database import get_async_db, url
+from app.main import app
+from app.query_budget import QueryBudgetExceeded, QueryBudgetMiddleware, query_budget
+
+PASSWORD = "budget"
+
+# sync engine to look things up around the requests
+engine = create_engine(url)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except OperationalError:
+        pytest.skip("database isn't reachable")
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def signup(client, email):
+    assert client.post("/user/", json={"email": email, "password": PASSWORD}).status_code == 201
+    response = client.post("/login", data={"username": email, "password": PASSWORD})
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_budgeted_routes_stay_within_budget(client):
+    # any route over its budget raises QueryBudgetExceeded out of the client
+    prefix = uuid.uuid4().hex[:8]
+    owner, other = f"budget-{prefix}-owner@example.com", f"budget-{prefix}-other@example.com"
+    mine, theirs = signup(client, owner), signup(client, other)
+
+    for i in range(3):
+        response = client.post("/posts/", json={"title": f"budget {prefix} {i}", "content": "x"}, headers=mine)
+        assert response.status_code == 201
+    # PostResponse has no id
+    with engine.connect() as conn:
+        post_ids = list(conn.scalars(select(models.Posts.id).join(models.User)
+                                     .where(models.User.email == owner).order_by(models.Posts.id)))
+        owner_id = conn.scalar(select(models.User.id).where(models.User.email == owner))
+
+    assert client.post("/follows/", json={"user_id": owner_id, "dir": 1}, headers=theirs).status_code == 201
+    assert client.get("/feed/", headers=theirs).status_code == 200
+    assert client.post("/votes/", json={"post_id": post_ids[0], "dir": 1}, headers=theirs).status_code == 201
+    assert client.post("/votes/", json={"post_id": post_ids[0], "dir": 0}, headers=theirs).status_code == 201
+    response = client.post("/votes/batch", json=[{"post_id": post_id, "dir": 1} for post_id in post_ids],
+                           headers=theirs)
+    assert response.status_code == 200
+
+    assert client.get("/posts/", params={"limit": 2}).status_code == 200
+    assert client.get(f"/posts/{post_ids[0]}").status_code == 200
+    assert client.get("/posts/search", params={"q": prefix}).status_code == 200
+    assert client.get("/posts/trending").status_code == 200
+    assert client.get("/posts/export", params={"owner_id": owner_id}).status_code == 200
+
+    body = {"title": "updated", "content": "y"}
+    assert client.put(f"/posts/{post_ids[0]}", json=body, headers=mine).status_code == 200
+    assert client.put(f"/posts/{post_ids[0]}", json=body, headers=theirs).status_code == 403
+    assert client.delete(f"/posts/{post_ids[1]}", headers=theirs).status_code == 403
+    assert client.delete(f"/posts/{post_ids[1]}", headers=mine).status_code == 204
+    assert client.post("/follows/", json={"user_id": owner_id, "dir": 0}, headers=theirs).status_code == 201
+
+    assert client.post("/refresh").status_code == 200
+    assert client.post("/logout").status_code == 200
+
+
+def test_over_budget_route_raises():
+    over_budget = FastAPI()
+
+    @over_budget.get("/n-plus-one")
+    @query_budget(1)
+    async def n_plus_one(db: AsyncSession = Depends(get_async_db)):
+        for _ in range(3):
+            await db.execute(text("SELECT 1"))
+        return {}
+
+    # counts through the engine events app.main set up for raise mode
+    with TestClient(QueryBudgetMiddleware(over_budget, mode="raise")) as client:
+        with pytest.raises(QueryBudgetExceeded, match="ran 3 SQL statements, budget is 1"):
+            client.get("/n-plus-one")
@@ -0,0 +1,117 @@
+"""VoteBuffer with a fake apply, no database needed (the settings from .env
+still are, like for the app)."""
+import asyncio
+
+import pytest
+
+from app.vote_buffer import VoteBuffer
+
+
+class FakeApply:
+    """Stands in for routers.vote.apply_votes, records every batch"""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.batches = []
+
+    async def __call__(self, db, ups, downs):
+        self.batches.append((sorted(ups), sorted(downs)))
+        if self.fail:
+            raise RuntimeError("database is down")
+        return set(), set()
+
+
+def make_buffer(apply, max_pending=100, flush_size=100):
+    return VoteBuffer(apply, max_pending=max_pending, flush_size=flush_size, flush_interval=60)
+
+
+def test_latest_vote_per_user_and_post_wins():
+    async def run():
+        apply = FakeApply()
+        buffer = make_buffer(apply)
+        await buffer.add(1, 10, 1)
+        await buffer.add(1, 10, 0)
+        await buffer.add(1, 11, 1)
+        await buffer.add(2, 10, 1)
+        assert len(buffer) == 3
+        await buffer.flush()
+        assert apply.batches == [([(1, 11), (2, 10)], [(1, 10)])]
+        assert len(buffer) == 0
+
+    asyncio.run(run())
+
+
+def test_flush_of_some_posts_keeps_the_others():
+    async def run():
+        apply = FakeApply()
+        buffer = make_buffer(apply)
+        await buffer.add(1, 10, 1)
+        await buffer.add(2, 10, 1)
+        await buffer.flush([1])
+        assert apply.batches == [([(1, 10)], [])]
+        assert not buffer.has_pending([1])
+        assert buffer.has_pending([2])
+
+    asyncio.run(run())
+
+
+def test_full_buffer_flushes_before_taking_more():
+    async def run():
+        apply = FakeApply()
+        buffer = make_buffer(apply, max_pending=2)
+        await buffer.add(1, 10, 1)
+        await buffer.add(2, 10, 1)
+        # same key as one already waiting, nothing new to hold
+        await buffer.add(2, 10, 0)
+        assert apply.batches == []
+        await buffer.add(3, 10, 1)
+        assert apply.batches == [([(1, 10)], [(2, 10)])]
+        assert len(buffer) == 1
+
+    asyncio.run(run())
+
+
+def test_failed_flush_puts_the_votes_back():
+    async def run():
+        apply = FakeApply(fail=True)
+        buffer = make_buffer(apply)
+        await buffer.add(1, 10, 1)
+        await buffer.add(2, 11, 0)
+        with pytest.raises(RuntimeError):
+            await buffer.flush()
+        assert len(buffer) == 2
+        assert buffer.has_pending([1]) and buffer.has_pending([2])
+
+        apply.fail = False
+        await buffer.flush()
+        assert apply.batches[-1] == ([(1, 10)], [(2, 11)])
+        assert len(buffer) == 0
+
+    asyncio.run(run())
+
+
+def test_failed_flush_doesnt_undo_a_newer_vote():
+    async def run():
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def apply(db, ups, downs):
+            started.set()
+            await release.wait()
+            raise RuntimeError("database is down")
+
+        buffer = make_buffer(apply)
+        await buffer.add(1, 10, 1)
+        flush = asyncio.create_task(buffer.flush())
+        await started.wait()
+        # the user changes their mind while the failing flush is in flight
+        await buffer.add(1, 10, 0)
+        release.set()
+        with pytest.raises(RuntimeError):
+            await flush
+
+        retry = FakeApply()
+        buffer.apply = retry
+        await buffer.flush()
+        assert retry.batches == [([], [(1, 10)])]
+
+    asyncio.run(run())